@@ -0,0 +1,219 @@
+"""
+Benchmark suite for the public functions of data_analysis.py.
+
+Description:
+    Every function is timed against the real catalog and against synthetic catalogs 10, 100 and 1000 times its size,
+    generated by synthetic_catalog from the distributions learned from the real one, so the larger catalogs have
+    distinct values rather than repeated rows. Each case runs in a fresh process so its peak resident memory is not
+    polluted by the cases before it. Results are written as JSON with the wall time, peak RSS and rows per second of
+    each case, and can be compared against a stored baseline to flag regressions.
+
+Direction to run the benchmarks:
+    1. python benchmark.py --output results.json
+    2. python benchmark.py --scales 1 10 --compare results.json
+    Every case reads its catalog from a csv file holding only the required columns. At 1000x that is still over a
+    gigabyte on disk, use --scales to leave the largest catalogs out.
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import constants as c
+import data_analysis as da
+import synthetic_catalog as sc
+
+EXOPLANETS_CSV = os.path.join('data', 'phl_exoplanet_catalog.csv')
+EXTREMOPHILES_CSV = os.path.join('data', 'Extremophiles Range.csv')
+SCALES = (1, 10, 100, 1000)
+BENCHMARKED_FUNCTIONS = ('create_exoplanets_catalog', 'calculate_ESI', 'get_habitable_zone_planets',
+                         'get_potentially_habitable_exoplanets', 'identify_habitability_type',
+                         'identifying_surviving_extremophiles', 'calculate_pressure')
+# a case is a regression when it is this much slower than the baseline
+DEFAULT_TOLERANCE = 0.25
+# seed of the synthetic catalogs, fixed so a run and its baseline time the same planets
+SYNTHETIC_SEED = 0
+
+
+def _peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    # Linux lets a process reset its high water mark, elsewhere the peak also covers the setup of the case
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def _prepare_case(function_name: str, csv_file_name: str):
+    exoplanets = da.create_exoplanets_catalog(csv_file_name)
+    if function_name == 'create_exoplanets_catalog':
+        return (csv_file_name,), len(exoplanets)
+    if function_name == 'calculate_ESI':
+        return (exoplanets,), len(exoplanets)
+    scored = da.calculate_ESI(exoplanets)
+    if function_name == 'identifying_surviving_extremophiles':
+        potentially_habitable = da.get_potentially_habitable_exoplanets(scored)
+        return (EXTREMOPHILES_CSV, potentially_habitable), len(potentially_habitable)
+    if function_name == 'calculate_pressure':
+        return (scored['P_DENSITY'] * c.DENSITY, scored['P_MASS'] * c.MASS,
+                scored['P_RADIUS'] * (c.DIAMETER / 2)), len(scored)
+    return (scored,), len(scored)
+
+
+def run_case(function_name: str, scale: int, csv_file_name: str, repeat: int = 3) -> dict:
+    """
+    Time one function at one scale in the current process.
+    :param function_name: name of a function in BENCHMARKED_FUNCTIONS.
+    :param scale: size of the catalog as a multiple of the real one.
+    :param csv_file_name: csv file written by write_scaled_csv for the scale.
+    :param repeat: number of timed runs, the fastest one is reported.
+    :return: dictionary with the function, scale, rows, wall_seconds, rows_per_second and peak_rss_bytes.
+    """
+    arguments, rows = _prepare_case(function_name, csv_file_name)
+    function = getattr(da, function_name)
+    _reset_peak_rss()
+    wall_seconds = float('inf')
+    for _ in range(repeat):
+        # calculate_ESI adds a column to its input, give every run a fresh copy so all runs do the same work
+        run_arguments = tuple(argument.copy() if isinstance(argument, pd.DataFrame) else argument
+                              for argument in arguments)
+        start = time.perf_counter()
+        function(*run_arguments)
+        wall_seconds = min(wall_seconds, time.perf_counter() - start)
+    return {'function': function_name, 'scale': scale, 'rows': rows, 'wall_seconds': wall_seconds,
+            'rows_per_second': rows / wall_seconds if wall_seconds else None, 'peak_rss_bytes': _peak_rss_bytes()}
+
+
+def write_scaled_csv(scale: int, directory: str, profile: dict = None) -> str:
+    """
+    Write a catalog scale times the size of the real one to a csv file: the required columns of the real catalog at
+    scale 1, else a synthetic catalog generated block by block.
+    :param scale: size of the catalog as a multiple of the real one.
+    :param directory: folder the csv file is written to.
+    :param profile: profile learned by synthetic_catalog.learn_exoplanets_profile, learned from the real catalog by
+    default.
+    :return: path of the csv file.
+    >>> directory = tempfile.mkdtemp()
+    >>> exoplanets = da.create_exoplanets_catalog(write_scaled_csv(2, directory))
+    >>> exoplanets.shape, exoplanets['P_NAME'].is_unique, exoplanets['P_NAME'].iloc[0]
+    ((8096, 20), True, 'SYN-0-0 b')
+    """
+    file_name = os.path.join(directory, 'phl_exoplanet_catalog_x{}.csv'.format(scale))
+    exoplanets = da.create_exoplanets_catalog(EXOPLANETS_CSV)
+    if scale == 1:
+        exoplanets.to_csv(file_name, index=False)
+    else:
+        sc.write_csv(file_name, sc.generate_exoplanet_chunks(scale * len(exoplanets), SYNTHETIC_SEED, profile))
+    return file_name
+
+
+def format_result(result: dict) -> str:
+    """
+    Format one result of run_case as a line of the progress report.
+    :param result: dictionary returned by run_case.
+    :return: line with the function, scale, wall time and rows per second, n/a when the run was too fast to measure.
+    >>> print(format_result({'function': 'calculate_ESI', 'scale': 10, 'wall_seconds': 0.5, 'rows_per_second': 8e4}))
+    calculate_ESI                            x10        0.5000s          80000 rows/s
+    >>> print(format_result({'function': 'calculate_ESI', 'scale': 1, 'wall_seconds': 0.0, 'rows_per_second': None}))
+    calculate_ESI                            x1         0.0000s            n/a rows/s
+    """
+    rows_per_second = result['rows_per_second']
+    return "{function:<40} x{scale:<5} {wall_seconds:10.4f}s {rate:>14} rows/s".format(
+        rate='n/a' if rows_per_second is None else '{:.0f}'.format(rows_per_second), **result)
+
+
+def run_benchmarks(functions=BENCHMARKED_FUNCTIONS, scales=SCALES, repeat: int = 3) -> dict:
+    """
+    Run every function at every scale, each case in its own process.
+    :param functions: names of the functions to benchmark.
+    :param scales: sizes of the catalogs to run against, as multiples of the real one.
+    :param repeat: number of timed runs per case.
+    :return: dictionary with details of the machine and a list of results, one per case.
+    """
+    context = multiprocessing.get_context('spawn')
+    profile = sc.learn_exoplanets_profile(EXOPLANETS_CSV) if any(scale != 1 for scale in scales) else None
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in scales:
+            csv_file_name = write_scaled_csv(scale, directory, profile)
+            for function_name in functions:
+                with context.Pool(1) as pool:
+                    result = pool.apply(run_case, (function_name, scale, csv_file_name, repeat))
+                print(format_result(result))
+                results.append(result)
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'pandas': pd.__version__,
+            'numpy': np.__version__, 'results': results}
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Find the cases that got slower than the baseline by more than the tolerance.
+    :param current: results returned by run_benchmarks.
+    :param baseline: stored results of an earlier run.
+    :param tolerance: allowed slowdown as a fraction of the baseline wall time.
+    :return: list of regressions with the function, scale, both wall times and the ratio between them.
+    >>> baseline = {'results': [{'function': 'calculate_ESI', 'scale': 1, 'wall_seconds': 0.010}]}
+    >>> current = {'results': [{'function': 'calculate_ESI', 'scale': 1, 'wall_seconds': 0.020}]}
+    >>> compare_results(current, baseline)
+    [{'function': 'calculate_ESI', 'scale': 1, 'baseline_seconds': 0.01, 'current_seconds': 0.02, 'ratio': 2.0}]
+    >>> compare_results(baseline, baseline)
+    []
+    """
+    baseline_seconds = {(result['function'], result['scale']): result['wall_seconds']
+                        for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        previous = baseline_seconds.get((result['function'], result['scale']))
+        if previous and result['wall_seconds'] > previous * (1 + tolerance):
+            regressions.append({'function': result['function'], 'scale': result['scale'],
+                                'baseline_seconds': previous, 'current_seconds': result['wall_seconds'],
+                                'ratio': result['wall_seconds'] / previous})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--functions', nargs='+', default=BENCHMARKED_FUNCTIONS, choices=BENCHMARKED_FUNCTIONS)
+    parser.add_argument('--scales', nargs='+', type=int, default=SCALES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='json file of a baseline run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.functions, arguments.scales, arguments.repeat)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(benchmark_results, output_file, indent=2)
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            found_regressions = compare_results(benchmark_results, json.load(baseline_file), arguments.tolerance)
+        for regression in found_regressions:
+            print("REGRESSION {function} x{scale}: {baseline_seconds:.4f}s -> {current_seconds:.4f}s "
+                  "({ratio:.2f}x)".format(**regression))
+        sys.exit(1 if found_regressions else 0)
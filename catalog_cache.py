@@ -0,0 +1,202 @@
+"""
+Columnar on-disk cache for the exoplanets catalog.
+
+Description:
+    create_exoplanets_catalog parses the full phl_exoplanet_catalog.csv text file on every call. This module stores the
+    required columns once, with their dtypes, in a columnar file next to the catalog and loads them back without any
+    text parsing. A cache entry is keyed on the size, modification time and SHA-256 of the source file plus the list
+    of required columns, and is rebuilt automatically when any of them changes.
+
+Cache formats:
+    1. npz - one uncompressed numpy array per column, needs nothing beyond numpy (default).
+    2. feather, parquet - written and read through pandas, need pyarrow to be installed.
+"""
+
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+CACHE_FORMATS = ('npz', 'feather', 'parquet')
+# cache files are kept in a hidden folder next to the catalog unless a directory is given
+CACHE_DIRECTORY_NAME = '.catalog_cache'
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def catalog_fingerprint(file_name, required_columns=None, content_hash: bool = True) -> dict:
+    r"""
+    Describe the state of a catalog file so a cache entry built from it can be validated.
+    :param file_name: path of the catalog csv file.
+    :param required_columns: columns kept from the catalog, by default the ones create_exoplanets_catalog reads.
+    :param content_hash: also hash the contents of the file, which needs a full read of it.
+    :return: dictionary with the size, modification time, content hash and required columns.
+    >>> fingerprint = catalog_fingerprint(".\\data\\phl_exoplanet_catalog.csv")
+    >>> sorted(fingerprint)
+    ['columns', 'mtime_ns', 'sha256', 'size']
+    """
+    if required_columns is None:
+        required_columns = da.REQUIRED_COLUMNS
+    file_status = os.stat(file_name)
+    fingerprint = {'size': file_status.st_size, 'mtime_ns': file_status.st_mtime_ns, 'sha256': None,
+                   'columns': list(required_columns)}
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as catalog_file:
+            for block in iter(lambda: catalog_file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+
+def cache_paths(file_name, cache_directory=None, cache_format: str = 'npz') -> (str, str):
+    """
+    Locate the data and metadata files of the cache entry for a catalog.
+    :param file_name: path of the catalog csv file.
+    :param cache_directory: folder holding the cache, by default a hidden folder next to the catalog.
+    :param cache_format: one of CACHE_FORMATS.
+    :return: path of the cached columns and path of the json metadata describing them.
+    """
+    if cache_format not in CACHE_FORMATS:
+        raise ValueError("cache_format must be one of {}, got {!r}".format(CACHE_FORMATS, cache_format))
+    source_path = os.path.abspath(file_name)
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(source_path), CACHE_DIRECTORY_NAME)
+    source_key = hashlib.sha1(source_path.encode('utf-8')).hexdigest()[:16]
+    stem = os.path.join(cache_directory, "{}.{}".format(os.path.splitext(os.path.basename(source_path))[0],
+                                                        source_key))
+    return "{}.{}".format(stem, cache_format), "{}.{}.json".format(stem, cache_format)
+
+
+def _write_columns(exoplanets_catalog: pd.DataFrame, data_path: str, cache_format: str):
+    if cache_format == 'npz':
+        columns = {}
+        for column in exoplanets_catalog.columns:
+            values = exoplanets_catalog[column].to_numpy()
+            # fixed width unicode instead of python objects so the file loads without pickle
+            columns[column] = values.astype(str) if values.dtype == object else values
+        with open(data_path, 'wb') as data_file:
+            np.savez(data_file, **columns)
+    elif cache_format == 'feather':
+        exoplanets_catalog.to_feather(data_path)
+    else:
+        exoplanets_catalog.to_parquet(data_path, index=False)
+
+
+def _read_columns(data_path: str, metadata: dict, cache_format: str) -> pd.DataFrame:
+    if cache_format == 'npz':
+        with np.load(data_path, allow_pickle=False) as columns:
+            exoplanets_catalog = pd.DataFrame({column: columns[column] for column in metadata['column_order']})
+    elif cache_format == 'feather':
+        exoplanets_catalog = pd.read_feather(data_path)
+    else:
+        exoplanets_catalog = pd.read_parquet(data_path)
+    return exoplanets_catalog
+
+
+def build_catalog_cache(file_name, cache_directory=None, cache_format: str = 'npz') -> pd.DataFrame:
+    """
+    Parse the catalog with create_exoplanets_catalog and store the result as a cache entry.
+    :param file_name: path of the catalog csv file.
+    :param cache_directory: folder holding the cache, by default a hidden folder next to the catalog.
+    :param cache_format: one of CACHE_FORMATS.
+    :return: the parsed catalog.
+    """
+    data_path, metadata_path = cache_paths(file_name, cache_directory, cache_format)
+    fingerprint = catalog_fingerprint(file_name)
+    exoplanets_catalog = da.create_exoplanets_catalog(file_name)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    # write to temporary files first so a reader never sees a half written entry
+    _write_columns(exoplanets_catalog, data_path + '.tmp', cache_format)
+    metadata = {'fingerprint': fingerprint, 'column_order': list(exoplanets_catalog.columns),
+                'rows': len(exoplanets_catalog)}
+    with open(metadata_path + '.tmp', 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+    os.replace(data_path + '.tmp', data_path)
+    os.replace(metadata_path + '.tmp', metadata_path)
+    return exoplanets_catalog
+
+
+def _is_fresh(file_name, metadata_path: str) -> bool:
+    try:
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, ValueError):
+        return False
+    cached = metadata['fingerprint']
+    if cached['columns'] != list(da.REQUIRED_COLUMNS):
+        return False
+    current = catalog_fingerprint(file_name, content_hash=False)
+    if (current['size'], current['mtime_ns']) == (cached['size'], cached['mtime_ns']):
+        return True
+    if current['size'] != cached['size']:
+        return False
+    # same size but touched, only the content hash can tell whether it really changed
+    current = catalog_fingerprint(file_name)
+    if current['sha256'] != cached['sha256']:
+        return False
+    metadata['fingerprint'] = current
+    with open(metadata_path, 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+    return True
+
+
+def load_exoplanets_catalog(file_name, cache_directory=None, cache_format: str = 'npz') -> pd.DataFrame:
+    r"""
+    Drop-in replacement for create_exoplanets_catalog that serves the catalog from the columnar cache.
+    :param file_name: path of the catalog csv file.
+    :param cache_directory: folder holding the cache, by default a hidden folder next to the catalog.
+    :param cache_format: one of CACHE_FORMATS.
+    :return: a dataframe with required columns, identical to create_exoplanets_catalog(file_name).
+    >>> import tempfile
+    >>> cache_directory = tempfile.mkdtemp()
+    >>> cold = load_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv", cache_directory)
+    >>> warm = load_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv", cache_directory)
+    >>> warm.equals(cold), warm.shape
+    (True, (4048, 20))
+    """
+    data_path, metadata_path = cache_paths(file_name, cache_directory, cache_format)
+    if not (os.path.exists(data_path) and _is_fresh(file_name, metadata_path)):
+        return build_catalog_cache(file_name, cache_directory, cache_format)
+    with open(metadata_path) as metadata_file:
+        metadata = json.load(metadata_file)
+    return _read_columns(data_path, metadata, cache_format)
+
+
+def clear_catalog_cache(file_name, cache_directory=None, cache_format: str = 'npz'):
+    """
+    Remove the cache entry of a catalog, if there is one.
+    :param file_name: path of the catalog csv file.
+    :param cache_directory: folder holding the cache, by default a hidden folder next to the catalog.
+    :param cache_format: one of CACHE_FORMATS.
+    """
+    for path in cache_paths(file_name, cache_directory, cache_format):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def catalog_load_times(file_name, cache_directory=None, cache_format: str = 'npz') -> dict:
+    r"""
+    Measure a cold load, which parses the csv and builds the cache, against a warm load served from the cache.
+    :param file_name: path of the catalog csv file.
+    :param cache_directory: folder holding the cache, by default a hidden folder next to the catalog.
+    :param cache_format: one of CACHE_FORMATS.
+    :return: dictionary with cold_seconds, warm_seconds and the speedup between them.
+    >>> import tempfile
+    >>> load_times = catalog_load_times(".\\data\\phl_exoplanet_catalog.csv", tempfile.mkdtemp())
+    >>> sorted(load_times)
+    ['cold_seconds', 'speedup', 'warm_seconds']
+    """
+    clear_catalog_cache(file_name, cache_directory, cache_format)
+    start = time.perf_counter()
+    load_exoplanets_catalog(file_name, cache_directory, cache_format)
+    cold_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    load_exoplanets_catalog(file_name, cache_directory, cache_format)
+    warm_seconds = time.perf_counter() - start
+    return {'cold_seconds': cold_seconds, 'warm_seconds': warm_seconds,
+            'speedup': cold_seconds / warm_seconds if warm_seconds else float('inf')}
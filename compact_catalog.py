@@ -0,0 +1,219 @@
+"""
+Compact in-memory representation of the exoplanets catalog and of the surviving extremophiles.
+
+Description:
+    create_exoplanets_catalog keeps the planet and star names as Python strings and every number as float64, and
+    identifying_surviving_extremophiles repeats a planet and a strain name on every surviving pair. In compact form
+    the names are integer coded categoricals, every float column that float32 holds within a relative tolerance is
+    stored as float32 and integer columns take the smallest integer type holding them. The planet distance and the
+    habitable zone bounds it is compared with stay float64 by default, so a planet never crosses a zone boundary
+    because of rounding; the ESI of a compacted catalog is within 1e-7 of the original and gives the same planets
+    above the ESI threshold and the same habitability classes. Survival is a bit matrix with one row per
+    planet and one bit per strain for each of SURVIVAL_CRITERIA, filled and packed a block of strains at a time so
+    no planet x strain array is ever held unpacked, and the named tables are only built when asked for.
+"""
+
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+# largest relative error allowed when a float64 column is stored as float32
+DOWNCAST_RELATIVE_TOLERANCE = 1e-6
+# columns compared exactly with each other by get_habitable_zone_planets, never downcast by default
+THRESHOLD_COLUMNS = ('P_DISTANCE', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX', 'S_HZ_CON_MIN', 'S_HZ_CON_MAX')
+# most planet x strain cells matched at a time, unpacked, when filling a SurvivalMatrix
+SURVIVAL_CELLS_PER_BLOCK = 2 ** 20
+
+
+def memory_bytes(value) -> int:
+    """
+    Measure the memory held by a dataframe, series, SurvivalMatrix or a tuple or list of them.
+    :param value: object to measure.
+    :return: number of bytes, strings included.
+    >>> memory_bytes(pd.Series([1, 2, 3], dtype='int8', index=pd.RangeIndex(3)))
+    135
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, SurvivalMatrix):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(memory_bytes(item) for item in value)
+    raise TypeError("can not measure the memory of {}".format(type(value).__name__))
+
+
+def _downcast_column(values: pd.Series, tolerance: float, keep_float64: bool) -> pd.Series:
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast='integer')
+    if not pd.api.types.is_float_dtype(values):
+        return values.astype('category')
+    if keep_float64:
+        return values
+    original = values.to_numpy(dtype=np.float64)
+    with np.errstate(over='ignore', invalid='ignore'):
+        downcast = original.astype(np.float32)
+        relative_error = np.abs(downcast.astype(np.float64) - original) / np.abs(original)
+    # zero, equal values and missing values on both sides are kept exactly
+    exact = (downcast.astype(np.float64) == original) | (np.isnan(original) & np.isnan(downcast))
+    if np.all(exact | (relative_error <= tolerance)):
+        return pd.Series(downcast, index=values.index, name=values.name)
+    return values
+
+
+def compact_exoplanets_catalog(exoplanets: pd.DataFrame, tolerance: float = DOWNCAST_RELATIVE_TOLERANCE,
+                               float64_columns=THRESHOLD_COLUMNS) -> pd.DataFrame:
+    r"""
+    Store the names of a catalog as categoricals and its numbers in the smallest type that holds them.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog.
+    :param tolerance: largest relative error allowed when a float64 column is stored as float32, 0 only downcasts
+    columns float32 holds exactly.
+    :param float64_columns: float columns never downcast, THRESHOLD_COLUMNS by default.
+    :return: dataframe with the same columns and index.
+    >>> planets = pd.DataFrame({'P_NAME': ['a', 'b'], 'S_NAME': ['A', 'A'], 'P_TEMP_MEASURED': [1.0, 0.1],
+    ...                         'P_DISTANCE': [1.0, 0.1], 'P_HABITABLE': [0, 2]})
+    >>> compact_exoplanets_catalog(planets).dtypes.astype(str).tolist()
+    ['category', 'category', 'float32', 'float64', 'int8']
+    >>> compact_exoplanets_catalog(planets, tolerance=0).dtypes.astype(str).tolist()
+    ['category', 'category', 'float64', 'float64', 'int8']
+    >>> exoplanets = da.calculate_ESI(da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv"))
+    >>> compact = da.calculate_ESI(compact_exoplanets_catalog(exoplanets.drop(columns='P_calculated_ESI')))
+    >>> compact.dtypes.astype(str).value_counts()[['float32', 'float64']].tolist()
+    [12, 6]
+    >>> bool(np.allclose(compact['P_calculated_ESI'], exoplanets['P_calculated_ESI'], rtol=0, atol=1e-7))
+    True
+    >>> da.get_potentially_habitable_exoplanets(compact).index.equals(
+    ...     da.get_potentially_habitable_exoplanets(exoplanets).index)
+    True
+    >>> da.get_habitable_zone_planets(compact).index.equals(da.get_habitable_zone_planets(exoplanets).index)
+    True
+    >>> da.classify_habitability(compact).equals(da.classify_habitability(exoplanets))
+    True
+    """
+    return pd.DataFrame({column: _downcast_column(exoplanets[column], tolerance, column in float64_columns)
+                         for column in exoplanets.columns}, index=exoplanets.index)
+
+
+def _extremophiles_dataframe(extremophiles_csv) -> pd.DataFrame:
+    if isinstance(extremophiles_csv, pd.DataFrame):
+        return extremophiles_csv
+    return da.read_extremophiles_ranges(extremophiles_csv)
+
+
+def survival_blocks(extremophiles: pd.DataFrame, exoplanets: pd.DataFrame, strains_multiple: int = 8,
+                    cells_per_block: int = SURVIVAL_CELLS_PER_BLOCK):
+    """
+    Match a block of strains at a time to the planets, so the survival of at most cells_per_block (planet, strain)
+    pairs per criterion is held unpacked at once.
+    :param extremophiles: dataframe returned by read_extremophiles_ranges.
+    :param exoplanets: dataframe of the planets to match.
+    :param strains_multiple: every block but the last holds a multiple of this many strains, so blocks pack into
+    whole words.
+    :param cells_per_block: largest number of planet x strain cells of a block.
+    :return: generator of the position of the first strain of each block and the criteria x planets x strains
+    boolean survival of the block.
+    """
+    block_size = max(1, cells_per_block // max(1, len(exoplanets)) // strains_multiple) * strains_multiple
+    for first_strain in range(0, len(extremophiles), block_size):
+        strains = extremophiles.iloc[first_strain:first_strain + block_size]
+        _, surviving_pairs = da.match_surviving_extremophiles(strains, exoplanets)
+        survives = np.zeros((len(da.SURVIVAL_CRITERIA), len(exoplanets), len(strains)), dtype=bool)
+        for criterion, (planet_positions, strain_positions) in enumerate(surviving_pairs):
+            survives[criterion, planet_positions, strain_positions] = True
+        yield first_strain, survives
+
+
+class SurvivalMatrix:
+    r"""
+    Planet x strain survival for each of SURVIVAL_CRITERIA, one bit per pair.
+    >>> planets = pd.DataFrame({'P_NAME': ['Earth'], 'P_MASS': [1.0], 'P_RADIUS': [1.0], 'P_DENSITY': [1.0],
+    ...                         'P_FLUX': [1.0], 'P_TEMP_EQUIL_MIN': [250.0], 'P_TEMP_EQUIL_MAX': [300.0]})
+    >>> survival = SurvivalMatrix.from_extremophiles_csv(".\\data\\Extremophiles Range.csv", planets)
+    >>> int(survival.survives('temperature').sum()), survival.bits.shape
+    (3, (3, 1, 3))
+    >>> survival.to_dataframe('temperature')
+      P_NAME                             Strain
+    0  Earth  Colwell/a piezophila ATCC BAA-637
+    1  Earth                 Colwell/a sp.MT-41
+    2  Earth            Pedobacter arcticus A12
+    """
+
+    def __init__(self, planet_names: pd.Categorical, strain_names: pd.Categorical, bits: np.ndarray):
+        self.planet_names = planet_names
+        self.strain_names = strain_names
+        # criteria x planets x ceil(strains / 8) bytes
+        self.bits = bits
+
+    @classmethod
+    def from_extremophiles_csv(cls, extremophiles_csv, exoplanets: pd.DataFrame) -> 'SurvivalMatrix':
+        """
+        Match the extremophiles to the planets as identifying_surviving_extremophiles does and keep the pairs as bits.
+        :param extremophiles_csv: csv file of the extremophiles and the ranges they survive, or the dataframe
+        read_extremophiles_ranges returns for it.
+        :param exoplanets: dataframe of the planets to match.
+        :return: SurvivalMatrix of the planets in catalog order and the strains in file order.
+        """
+        extremophiles = _extremophiles_dataframe(extremophiles_csv)
+        strain_names = extremophiles['Strain'].to_numpy()
+        bits = np.zeros((len(da.SURVIVAL_CRITERIA), len(exoplanets), -(-len(strain_names) // 8)), dtype=np.uint8)
+        for first_strain, survives in survival_blocks(extremophiles, exoplanets):
+            bits[:, :, first_strain // 8:first_strain // 8 + -(-survives.shape[2] // 8)] = np.packbits(survives, axis=2)
+        return cls(pd.Categorical(exoplanets['P_NAME']), pd.Categorical(strain_names), bits)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes + sum(int(pd.Series(names).memory_usage(deep=True, index=False))
+                                      for names in (self.planet_names, self.strain_names))
+
+    def survives(self, criterion: str) -> np.ndarray:
+        """
+        Unpack one criterion.
+        :param criterion: one of SURVIVAL_CRITERIA.
+        :return: planets x strains boolean array.
+        """
+        if criterion not in da.SURVIVAL_CRITERIA:
+            raise ValueError("criterion must be one of {}, got {!r}".format(da.SURVIVAL_CRITERIA, criterion))
+        return np.unpackbits(self.bits[da.SURVIVAL_CRITERIA.index(criterion)], axis=1,
+                             count=len(self.strain_names)).astype(bool)
+
+    def to_dataframe(self, criterion: str) -> pd.DataFrame:
+        """
+        Build the named table of one criterion, in the order identifying_surviving_extremophiles returns it.
+        :param criterion: one of SURVIVAL_CRITERIA.
+        :return: dataframe with P_NAME and Strain columns, one row per surviving pair.
+        """
+        strain_positions, planet_positions = np.nonzero(self.survives(criterion).T)
+        return da.surviving_pairs_to_dataframe(np.asarray(self.planet_names), np.asarray(self.strain_names),
+                                               planet_positions, strain_positions)
+
+    def to_dataframes(self) -> tuple:
+        """
+        Build the three tables returned by identifying_surviving_extremophiles.
+        :return: temperature, pressure and radiation surviving extremophiles.
+        """
+        return tuple(self.to_dataframe(criterion) for criterion in da.SURVIVAL_CRITERIA)
+
+
+def compact_memory_report(exoplanets: pd.DataFrame, extremophiles_csv) -> pd.DataFrame:
+    r"""
+    Compare the memory of the catalog and of the surviving extremophiles before and after compaction.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog.
+    :param extremophiles_csv: csv file of the extremophiles and the ranges they survive.
+    :return: dataframe with the bytes before and after and their ratio, for the catalog and the survival tables.
+    >>> exoplanets = da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")
+    >>> report = compact_memory_report(exoplanets, ".\\data\\Extremophiles Range.csv")
+    >>> bool((report['after_bytes'] < report['before_bytes']).all())
+    True
+    >>> report.loc['catalog', ['before_bytes', 'after_bytes']].tolist()
+    [1128150, 853145]
+    """
+    survival_tables = da.identifying_surviving_extremophiles(extremophiles_csv, exoplanets)
+    before = {'catalog': memory_bytes(exoplanets), 'surviving_extremophiles': memory_bytes(survival_tables)}
+    after = {'catalog': memory_bytes(compact_exoplanets_catalog(exoplanets)),
+             'surviving_extremophiles': memory_bytes(SurvivalMatrix.from_extremophiles_csv(extremophiles_csv,
+                                                                                           exoplanets))}
+    report = pd.DataFrame({'before_bytes': before, 'after_bytes': after})
+    report['ratio'] = report['before_bytes'] / report['after_bytes']
+    return report
@@ -15,7 +15,7 @@ Description:
 Pre-requisite Installations:
     1. Install these libraries in your cloned project via PyCharm:
         1. pandas
-        2. pandasql
+        2. numpy
         3. ipywidgets
         4. matplotlib
 
@@ -33,6 +33,8 @@ Direction to run the program:
     1. Ensure 'phl_exoplanet_catalog.csv' in the 'data' folder.
     2. Run the main method in 'data_analysis.py' file to perform the analysis and derive the result for hypothesis.
     3. Run each cell in the 'visualizations.ipynb' file to visualize the hypothesis.
+    4. To see where a run spends its time, set EXOPLANETS_INSTRUMENTATION to an output prefix (and EXOPLANETS_PROFILE=1
+    for cProfile), see 'instrumentation.py'.
 
 Database References:
     1. [1] - Exoplanets catalog:
@@ -50,16 +52,45 @@ Research References:
 """
 
 
+import hashlib
+import os
+import weakref
+
+import numpy as np
 import pandas as pd
 import constants as c
-import pandasql as ps
-
-
+from instrumentation import instrument_stage
+
+# columns of phl_exoplanet_catalog.csv required for our analysis
+REQUIRED_COLUMNS = ['P_NAME', 'P_MASS', 'P_RADIUS', 'P_TEMP_MEASURED', 'P_ESCAPE', 'P_DENSITY', 'P_DISTANCE',
+                    'P_FLUX', 'P_TEMP_EQUIL', 'P_TEMP_EQUIL_MIN', 'P_TEMP_EQUIL_MAX', 'S_RADIUS_EST',
+                    'S_NAME', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX', 'S_HZ_CON_MIN', 'S_HZ_CON_MAX',
+                    'P_HABITABLE', 'P_RADIUS_EST', 'P_MASS_EST']
+# planetary properties used to calculate the ESI and the columns holding their similarity terms
+ESI_PROPERTY_COLUMNS = ['P_RADIUS', 'P_DENSITY', 'P_ESCAPE', 'P_TEMP_EQUIL']
+ESI_COMPONENT_COLUMNS = ['P_ESI_RADIUS', 'P_ESI_DENSITY', 'P_ESI_ESCAPE', 'P_ESI_TEMPERATURE']
+# dtypes of the numeric required columns, as inferred when the whole catalog is read at once
+CATALOG_NUMERIC_DTYPES = {column: ('int64' if column == 'P_HABITABLE' else 'float64')
+                          for column in REQUIRED_COLUMNS if column not in ('P_NAME', 'S_NAME')}
+# columns returned by convert_to_si_units: kg, m, kg/m^3, W/m^2 and bars
+SI_UNIT_COLUMNS = ['P_MASS', 'P_RADIUS', 'P_DENSITY', 'P_FLUX', 'P_PRESSURE']
+# conditions checked by match_surviving_extremophiles, in the order it returns them
+SURVIVAL_CRITERIA = ['temperature', 'pressure', 'radiation']
+# labels given by classify_habitability, ordered by their code
+HABITABILITY_CLASSES = ['neither', 'conservative', 'optimistic', 'both']
+# number of catalog rows held in memory at a time by the streaming functions
+DEFAULT_CHUNK_SIZE = 100000
+# labels already given by classify_habitability with their version or values fingerprint, by id of the dataframe
+_habitability_classes = {}
+
+
+@instrument_stage
 def create_exoplanets_catalog(file_name) -> pd.DataFrame:
-    """
+    r"""
     Read from phl_exoplanet_catalog.csv file and create a dataframe with required columns.
 
-    :param file_name: given a file name read required columns and store and return the data in pandas dataframe.
+    :param file_name: given a file name read required columns and store and return the data in pandas dataframe, or
+    a folder written by mapped_catalog.convert_catalog_csv.
     :return: a dataframe with required columns.
     >>> create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")
     ... # doctest: +NORMALIZE_WHITESPACE
@@ -78,25 +109,81 @@ def create_exoplanets_catalog(file_name) -> pd.DataFrame:
     <BLANKLINE>
     [4048 rows x 20 columns]
     """
-    required_columns = ['P_NAME', 'P_MASS', 'P_RADIUS', 'P_TEMP_MEASURED', 'P_ESCAPE', 'P_DENSITY', 'P_DISTANCE',
-                        'P_FLUX', 'P_TEMP_EQUIL', 'P_TEMP_EQUIL_MIN', 'P_TEMP_EQUIL_MAX', 'S_RADIUS_EST',
-                        'S_NAME', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX', 'S_HZ_CON_MIN', 'S_HZ_CON_MAX',
-                        'P_HABITABLE', 'P_RADIUS_EST', 'P_MASS_EST']
+    if os.path.isdir(file_name):
+        # a folder written by mapped_catalog.convert_catalog_csv, mapped instead of parsed
+        from mapped_catalog import MappedCatalog, is_mapped_catalog
+        if not is_mapped_catalog(file_name):
+            raise ValueError("{} is a folder without a mapped catalog manifest, convert the csv file with "
+                             "mapped_catalog.convert_catalog_csv".format(file_name))
+        return MappedCatalog(file_name).to_dataframe()
     # load data file with columns required for our analysis into data frame
     exoplanets_catalog = pd.read_csv(
         # input file name (change here if need be)
         file_name,
         # read only required columns
-        usecols=lambda column_name: column_name in required_columns
+        usecols=REQUIRED_COLUMNS
     )
     exoplanets_catalog = exoplanets_catalog.fillna(0)
     return exoplanets_catalog
 
 
-def calculate_ESI(exoplanets: pd.DataFrame) -> pd.DataFrame:
+def read_exoplanets_catalog_in_chunks(file_name, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    r"""
+    Read phl_exoplanet_catalog.csv a bounded number of rows at a time, with the same columns and cleaning as
+    create_exoplanets_catalog.
+    :param file_name: given a file name read required columns in chunks.
+    :param chunk_size: number of rows read per chunk.
+    :return: generator of dataframes with required columns, indexed by their row number in the file.
+    >>> chunks = read_exoplanets_catalog_in_chunks(".\\data\\phl_exoplanet_catalog.csv", 1000)
+    >>> [len(chunk) for chunk in chunks]
+    [1000, 1000, 1000, 1000, 48]
+    >>> import io
+    >>> csv_file = io.StringIO(','.join(REQUIRED_COLUMNS) + '\n' + 'a' + ',' * (len(REQUIRED_COLUMNS) - 1) + '\n')
+    >>> next(read_exoplanets_catalog_in_chunks(csv_file))['P_HABITABLE'].tolist()
+    [0]
     """
+    # fix the dtypes up front, otherwise a chunk without missing or decimal values would be read as integers; integer
+    # columns are read as floats so blank values parse, and cast once they are filled like create_exoplanets_catalog
+    parse_dtypes = {column: 'float64' for column in CATALOG_NUMERIC_DTYPES}
+    with pd.read_csv(file_name, usecols=REQUIRED_COLUMNS, dtype=parse_dtypes, chunksize=chunk_size) as reader:
+        for exoplanets_chunk in reader:
+            yield exoplanets_chunk.fillna(0).astype(CATALOG_NUMERIC_DTYPES)
+
+
+@instrument_stage
+def stream_habitable_exoplanets(file_name, chunk_size: int = DEFAULT_CHUNK_SIZE) -> (pd.DataFrame, pd.DataFrame):
+    r"""
+    Score the catalog chunk by chunk and keep only the planets that survive the habitable zone or the ESI filter,
+    so memory is bounded by the chunk size and the number of survivors rather than by the size of the catalog.
+    :param file_name: given a file name read required columns in chunks.
+    :param chunk_size: number of rows read and scored at a time.
+    :return: same results as get_habitable_zone_planets and get_potentially_habitable_exoplanets applied to
+    calculate_ESI(create_exoplanets_catalog(file_name)).
+    >>> habitable_zone, potentially_habitable = stream_habitable_exoplanets(".\\data\\phl_exoplanet_catalog.csv", 500)
+    >>> len(habitable_zone), len(potentially_habitable)
+    (197, 27)
+    """
+    scored_chunks = (calculate_ESI(exoplanets_chunk)
+                     for exoplanets_chunk in read_exoplanets_catalog_in_chunks(file_name, chunk_size))
+    habitable_zone_planets = []
+    potentially_habitable_exoplanets = []
+    for scored_chunk in scored_chunks:
+        if not habitable_zone_planets:
+            # empty frames with the right columns, in case nothing survives
+            habitable_zone_planets.append(scored_chunk.iloc[0:0])
+            potentially_habitable_exoplanets.append(scored_chunk.iloc[0:0])
+        habitable_zone_planets.append(get_habitable_zone_planets(scored_chunk))
+        potentially_habitable_exoplanets.append(get_potentially_habitable_exoplanets(scored_chunk))
+    return pd.concat(habitable_zone_planets), pd.concat(potentially_habitable_exoplanets)
+
+
+@instrument_stage
+def calculate_ESI(exoplanets: pd.DataFrame, chunk_size: int = None, include_components: bool = False) -> pd.DataFrame:
+    r"""
     Calculate the ESI on basis of 4 planetary properties.
     :param exoplanets: required dataframe from which we use values to calculate our own ESI.
+    :param chunk_size: number of planets scored at a time, by default the whole dataframe in one pass.
+    :param include_components: also add the similarity term of each property as P_ESI_* columns.
     :return: same input dataframe with an additional column of calculated_ESI.
     >>> calculate_ESI(create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv"))
               P_NAME      P_MASS  ...   P_MASS_EST  P_calculated_ESI
@@ -114,8 +201,6 @@ def calculate_ESI(exoplanets: pd.DataFrame) -> pd.DataFrame:
     <BLANKLINE>
     [4048 rows x 21 columns]
     """
-    # Subset the dataframe to required columns
-    ESI_fields_exoplanet_details = exoplanets[['P_RADIUS', 'P_DENSITY', 'P_ESCAPE', 'P_TEMP_EQUIL']]
     # Reference data of earth used as terrestrial reference values
     terrestrial_reference_value = [c.REFERENCE_VALUE_RADIUS, c.REFERENCE_VALUE_DENSITY,
                                    c.REFERENCE_VALUE_VELOCITY, c.REFERENCE_VALUE_TEMPERATURE]
@@ -123,25 +208,53 @@ def calculate_ESI(exoplanets: pd.DataFrame) -> pd.DataFrame:
     weight_exponent = [c.WEIGHT_EXPONENT_RADIUS, c.WEIGHT_EXPONENT_DENSITY,
                        c.WEIGHT_EXPONENT_VELOCITY, c.WEIGHT_EXPONENT_TEMPERATURE]
     n = c.NUMBER_OF_PARAMETERS_TO_CALCULATE_ESI
-    P_ESI = []
-    # Calculate ESI for each planet
-    for each_row in range(0, ESI_fields_exoplanet_details.shape[0]):
-        earth_similarity_index = 1
-        for each_parameter in range(1, ESI_fields_exoplanet_details.shape[1]):
-            xi = float(ESI_fields_exoplanet_details.iloc[each_row][each_parameter])
-            xio = terrestrial_reference_value[each_parameter]
-            wi = weight_exponent[each_parameter]
-            # [3]
-            earth_similarity_index *= (1 - abs((xi - xio) / (xi + xio))) ** wi
-        earth_similarity_index = earth_similarity_index ** (1 / n)
-        # Calculated Earth similarity index appended to final dataframe
-        P_ESI.append(earth_similarity_index)
+    # Column views over the required fields, no per-row lookups
+    ESI_fields_exoplanet_details = [exoplanets[column].to_numpy(dtype=float) for column in ESI_PROPERTY_COLUMNS]
+    number_of_planets = len(exoplanets)
+    if chunk_size is None:
+        chunk_size = max(number_of_planets, 1)
+    P_ESI = np.empty(number_of_planets)
+    P_ESI_components = np.empty((len(ESI_PROPERTY_COLUMNS), number_of_planets)) if include_components else None
+    # Calculate ESI for a block of planets at a time to bound the size of the temporaries
+    for start in range(0, number_of_planets, chunk_size):
+        stop = min(start + chunk_size, number_of_planets)
+        similarity_terms = [calculate_similarity_term(values[start:stop], xio, wi)
+                            for values, xio, wi in zip(ESI_fields_exoplanet_details,
+                                                        terrestrial_reference_value, weight_exponent)]
+        # The radius term is reported as a component only, the index itself has always been built from
+        # density, escape velocity and temperature
+        earth_similarity_index = similarity_terms[1] * similarity_terms[2] * similarity_terms[3]
+        P_ESI[start:stop] = earth_similarity_index ** (1 / n)
+        if include_components:
+            for each_parameter, term in enumerate(similarity_terms):
+                P_ESI_components[each_parameter, start:stop] = term
+    # Calculated Earth similarity index appended to final dataframe
     exoplanets['P_calculated_ESI'] = P_ESI
+    if include_components:
+        for column, component in zip(ESI_COMPONENT_COLUMNS, P_ESI_components):
+            exoplanets[column] = component
     return exoplanets
 
 
-def get_habitable_zone_planets(exoplanets: pd.DataFrame) -> pd.DataFrame:
+@instrument_stage
+def calculate_similarity_term(values, reference_value, weight_exponent):
     """
+    Calculate the weighted similarity of one planetary property to its terrestrial reference value.
+    :param values: array of the planetary property for each planet.
+    :param reference_value: terrestrial reference value of the property.
+    :param weight_exponent: weight exponent of the property.
+    :return: array with the similarity term of each planet.
+    >>> calculate_similarity_term(np.array([1.0, 0.0, 3.0]), c.REFERENCE_VALUE_DENSITY, 1)
+    array([1. , 0. , 0.5])
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # [3]
+        return (1 - np.abs((values - reference_value) / (values + reference_value))) ** weight_exponent
+
+
+@instrument_stage
+def get_habitable_zone_planets(exoplanets: pd.DataFrame) -> pd.DataFrame:
+    r"""
     Returns list of exoplanets that fall in the habitable zone.
     :param exoplanets: same input dataframe with filtered exoplanets.
     :return:
@@ -168,8 +281,9 @@ def get_habitable_zone_planets(exoplanets: pd.DataFrame) -> pd.DataFrame:
     # return exoplanets.loc[(exoplanets['P_HABITABLE'] == 1) | (exoplanets['P_HABITABLE'] == 2)]
 
 
+@instrument_stage
 def get_potentially_habitable_exoplanets(exoplanets: pd.DataFrame) -> pd.DataFrame:
-    """
+    r"""
     Filter exoplanets with ESI >= 0.6
     :param exoplanets: required dataframe with calculated ESI.
     :return: same input dataframe with filtered exoplanets.
@@ -208,10 +322,12 @@ def get_potentially_habitable_exoplanets(exoplanets: pd.DataFrame) -> pd.DataFra
     return exoplanets.loc[(exoplanets['P_calculated_ESI'] >= 0.6)]
 
 
-def identify_habitability_type(exoplanets: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
-    """
+@instrument_stage
+def identify_habitability_type(exoplanets: pd.DataFrame, version=None) -> (pd.DataFrame, pd.DataFrame):
+    r"""
     Distinguish between the two types
     :param exoplanets:
+    :param version: optional token passed on to classify_habitability instead of the fingerprint of the values.
     :return:
     >>> df = calculate_ESI(create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv"))
     >>> p_df = df.loc[(df['P_calculated_ESI'] >= 0.6)]
@@ -238,25 +354,70 @@ def identify_habitability_type(exoplanets: pd.DataFrame) -> (pd.DataFrame, pd.Da
     3663   LHS 1140 b       1.72634    6.979503          0.708638)
     """
     habitability_details = exoplanets[['P_NAME', 'P_RADIUS_EST', 'P_MASS_EST', 'P_calculated_ESI']]
+    habitability_class = classify_habitability(exoplanets, version).to_numpy()
     conservative_habitable_planets = habitability_details.loc[
-        ((0.5 < (round(habitability_details['P_RADIUS_EST'], 2)))
-         & (round(habitability_details['P_RADIUS_EST'], 2) <= 1.5))
-        |
-        ((0.1 < (round(habitability_details['P_MASS_EST'], 2)))
-         & (round(habitability_details['P_MASS_EST'], 2) <= 5.0))
-        ]
+        (habitability_class == 'conservative') | (habitability_class == 'both')]
     optimistic_habitable_planets = habitability_details.loc[
-        ((1.5 < (round(habitability_details['P_RADIUS_EST'], 2)))
-         & (round(habitability_details['P_RADIUS_EST'], 2) <= 2.5))
-        |
-        ((5.1 < (round(habitability_details['P_MASS_EST'], 2)))
-         & (round(habitability_details['P_MASS_EST'], 2) <= 10.0))
-        ]
+        (habitability_class == 'optimistic') | (habitability_class == 'both')]
     return conservative_habitable_planets, optimistic_habitable_planets
 
 
-def identifying_surviving_extremophiles(extremophiles_csv, potentially_habitable_exoplanets_local):
+@instrument_stage
+def classify_habitability(exoplanets: pd.DataFrame, version=None) -> pd.Series:
+    """
+    Label each planet as conservative, optimistic, both or neither in one pass over its rounded radius and mass.
+    The labels are remembered for the dataframe together with a fingerprint of its radius and mass values, so asking
+    again for the same, unchanged dataframe only hashes the two columns. A caller that tracks its changes can pass a
+    version instead, which skips the hashing; it then changes the version whenever it changes the radius or mass.
+    :param exoplanets: dataframe with P_RADIUS_EST and P_MASS_EST columns.
+    :param version: optional hashable token naming the current content of the dataframe, used instead of the
+    fingerprint of its values.
+    :return: categorical series of labels aligned with the input.
+    >>> planets = pd.DataFrame({'P_RADIUS_EST': [1.0, 2.0, 1.2, 4.0], 'P_MASS_EST': [1.0, 4.0, 6.0, 60.0]})
+    >>> classify_habitability(planets).tolist()
+    ['conservative', 'both', 'both', 'neither']
+    >>> classify_habitability(planets) is classify_habitability(planets)
+    True
+    >>> planets.loc[3, 'P_MASS_EST'] = 2.0
+    >>> classify_habitability(planets).tolist()
+    ['conservative', 'both', 'both', 'conservative']
+    >>> classify_habitability(planets, version=1) is classify_habitability(planets, version=1)
+    True
     """
+    if version is None:
+        version = _habitability_fingerprint(exoplanets)
+    cached = _habitability_classes.get(id(exoplanets))
+    if cached is not None and cached[0] == version and cached[1].index is exoplanets.index:
+        return cached[1]
+    radius = exoplanets['P_RADIUS_EST'].to_numpy()
+    mass = exoplanets['P_MASS_EST'].to_numpy()
+    rounded_radius = np.round(radius, 2)
+    rounded_mass = np.round(mass, 2)
+    conservative = (((0.5 < rounded_radius) & (rounded_radius <= 1.5))
+                    | ((0.1 < rounded_mass) & (rounded_mass <= 5.0)))
+    optimistic = (((1.5 < rounded_radius) & (rounded_radius <= 2.5))
+                  | ((5.1 < rounded_mass) & (rounded_mass <= 10.0)))
+    habitability_class = pd.Series(pd.Categorical.from_codes(conservative + 2 * optimistic,
+                                                             categories=HABITABILITY_CLASSES),
+                                   index=exoplanets.index, name='P_HABITABILITY_CLASS')
+    if id(exoplanets) not in _habitability_classes:
+        # forget the labels once the dataframe itself is gone
+        weakref.finalize(exoplanets, _habitability_classes.pop, id(exoplanets), None)
+    _habitability_classes[id(exoplanets)] = (version, habitability_class)
+    return habitability_class
+
+
+def _habitability_fingerprint(exoplanets: pd.DataFrame) -> tuple:
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for column in ('P_RADIUS_EST', 'P_MASS_EST'):
+        fingerprint.update(np.ascontiguousarray(exoplanets[column].to_numpy(dtype=np.float64)).data)
+    # tagged, so a version passed by a caller never equals a fingerprint
+    return '_habitability_fingerprint', fingerprint.digest()
+
+
+@instrument_stage
+def identifying_surviving_extremophiles(extremophiles_csv, potentially_habitable_exoplanets_local):
+    r"""
     Identifies Extremophiles that can survive on Potentially Habitable Exoplanets.
     :param potentially_habitable_exoplanets_local: A dataframe containing all potentially habitable planets.
     :param extremophiles_csv: A CSV
@@ -289,7 +450,7 @@ def identifying_surviving_extremophiles(extremophiles_csv, potentially_habitable
     14    HD 80606 b  "Geothermobacterium terrireducens" FW-1a
     15    KOI-3680 b  "Geothermobacterium terrireducens" FW-1a
     16  Kepler-539 b  "Geothermobacterium terrireducens" FW-1a
-    17    HD 80606 b             Shewane/18 piezotOlerans\\nWP3
+    17    HD 80606 b             Shewane/18 piezotOlerans\nWP3
     18    HD 80606 b                        Colwell/a sp.MT-41
     19       K2-18 b                        Colwell/a sp.MT-41
     20  TRAPPIST-1 d                        Colwell/a sp.MT-41
@@ -370,46 +531,240 @@ def identifying_surviving_extremophiles(extremophiles_csv, potentially_habitable
     26  TRAPPIST-1 g   Halobacterium salinarum NRC-1)
     """
 
-    converted_units_df = pd.DataFrame()
+    planet_names = potentially_habitable_exoplanets_local['P_NAME'].to_numpy()
+    strain_names, surviving_pairs = match_surviving_extremophiles(extremophiles_csv,
+                                                                  potentially_habitable_exoplanets_local)
+    temperature_surviving_extremophiles, pressure_surviving_extremophiles, radiation_surviving_extremophiles = (
+        surviving_pairs_to_dataframe(planet_names, strain_names, *pairs) for pairs in surviving_pairs)
 
-    converted_units_df['P_NAME'] = potentially_habitable_exoplanets_local['P_NAME']
-    converted_units_df['S_NAME'] = potentially_habitable_exoplanets_local['S_NAME']
-    converted_units_df.loc[:, 'P_MASS'] = potentially_habitable_exoplanets_local['P_MASS'] * c.MASS
-    converted_units_df.loc[:, 'P_RADIUS'] = potentially_habitable_exoplanets_local['P_RADIUS'] * (c.DIAMETER / 2)
-    converted_units_df.loc[:, 'P_DENSITY'] = potentially_habitable_exoplanets_local['P_DENSITY'] * c.DENSITY
-    converted_units_df.loc[:, 'P_FLUX'] = potentially_habitable_exoplanets_local['P_FLUX'] * c.SOLAR_FLUX
-    converted_units_df.loc[:, 'P_TEMP_EQUIL_MIN'] = potentially_habitable_exoplanets_local['P_TEMP_EQUIL_MIN']
-    converted_units_df.loc[:, 'P_TEMP_EQUIL_MAX'] = potentially_habitable_exoplanets_local['P_TEMP_EQUIL_MAX']
+    return temperature_surviving_extremophiles, pressure_surviving_extremophiles, radiation_surviving_extremophiles
 
-    converted_units_df['P_PRESSURE'] = calculate_pressure(converted_units_df['P_DENSITY'],
-                                                          converted_units_df['P_MASS'],
-                                                          converted_units_df['P_RADIUS'])
-    converted_units_df = converted_units_df.set_index('P_NAME')
 
+@instrument_stage
+def read_extremophiles_ranges(extremophiles_csv) -> pd.DataFrame:
+    r"""
+    Read the ranges in which each extremophile survives, with missing limits as 0.
+    :param extremophiles_csv: A CSV file containing information such as temperature, pressure, and radiation in which
+    an Extremophile can survive.
+    :return: dataframe with one row per strain.
+    >>> read_extremophiles_ranges(".\\data\\Extremophiles Range.csv").shape
+    (23, 7)
+    """
     extremophiles_df = pd.DataFrame(pd.read_csv(extremophiles_csv,
                                                 usecols=['Strain', 'Extremophile_Type', 'Temperature_Min_K',
                                                          'Temperature_Max_K', 'Pressure_Min_Bars', 'Pressure_Max_Bars',
                                                          'Radiation']))
-    extremophiles_df = extremophiles_df.fillna(0)
-    temperature_surviving_extremophiles = ps.sqldf(
-        "Select converted_units_df.P_NAME , extremophiles_df.Strain "
-        "from extremophiles_df left outer join converted_units_df "
-        "where extremophiles_df.Temperature_Min_K >= converted_units_df.P_TEMP_EQUIL_MIN "
-        "and extremophiles_df.Temperature_Max_K <= converted_units_df.P_TEMP_EQUIL_MAX")
-
-    pressure_surviving_extremophiles = ps.sqldf(
-        "Select converted_units_df.P_NAME , extremophiles_df.Strain "
-        "from extremophiles_df left outer join converted_units_df "
-        "where extremophiles_df.Pressure_Min_Bars >= converted_units_df.P_PRESSURE")
-
-    radiation_surviving_extremophiles = ps.sqldf(
-        "Select converted_units_df.P_NAME , extremophiles_df.Strain "
-        "from extremophiles_df left outer join converted_units_df "
-        "where extremophiles_df.Radiation >= converted_units_df.P_FLUX")
-
-    return temperature_surviving_extremophiles, pressure_surviving_extremophiles, radiation_surviving_extremophiles
+    return extremophiles_df.fillna(0)
+
+
+@instrument_stage
+def match_surviving_extremophiles(extremophiles_csv, exoplanets: pd.DataFrame) -> (np.ndarray, list):
+    r"""
+    Find the extremophiles surviving on each planet as positions, before any name is looked up.
+    :param extremophiles_csv: A CSV file containing information such as temperature, pressure, and radiation in which
+    an Extremophile can survive, or the dataframe read_extremophiles_ranges returns for it.
+    :param exoplanets: dataframe of the planets to match.
+    :return: array of the strain names and, for each of SURVIVAL_CRITERIA, the planet and strain positions of the
+    surviving pairs as returned by match_extremophile_ranges.
+    >>> planets = pd.DataFrame({'P_NAME': ['Earth'], 'P_MASS': [1.0], 'P_RADIUS': [1.0], 'P_DENSITY': [1.0],
+    ...                         'P_FLUX': [1.0], 'P_TEMP_EQUIL_MIN': [250.0], 'P_TEMP_EQUIL_MAX': [300.0]})
+    >>> strain_names, surviving_pairs = match_surviving_extremophiles(".\\data\\Extremophiles Range.csv", planets)
+    >>> strain_names[surviving_pairs[0][1]].tolist()
+    ['Colwell/a piezophila ATCC BAA-637', 'Colwell/a sp.MT-41', 'Pedobacter arcticus A12']
+    """
+    converted_units_df = convert_to_si_units(exoplanets)
+
+    if isinstance(extremophiles_csv, pd.DataFrame):
+        extremophiles_df = extremophiles_csv
+    else:
+        extremophiles_df = read_extremophiles_ranges(extremophiles_csv)
+    # strains whose temperature range lies within the temperature range of the planet
+    temperature_surviving_pairs = match_extremophile_ranges(exoplanets['P_TEMP_EQUIL_MIN'].to_numpy(),
+                                                            extremophiles_df['Temperature_Min_K'].to_numpy(),
+                                                            exoplanets['P_TEMP_EQUIL_MAX'].to_numpy(),
+                                                            extremophiles_df['Temperature_Max_K'].to_numpy())
+    # strains that withstand at least the surface pressure of the planet
+    pressure_surviving_pairs = match_extremophile_ranges(converted_units_df['P_PRESSURE'].to_numpy(),
+                                                         extremophiles_df['Pressure_Min_Bars'].to_numpy())
+    # strains that withstand at least the stellar flux received by the planet
+    radiation_surviving_pairs = match_extremophile_ranges(converted_units_df['P_FLUX'].to_numpy(),
+                                                          extremophiles_df['Radiation'].to_numpy())
+    return (extremophiles_df['Strain'].to_numpy(),
+            [temperature_surviving_pairs, pressure_surviving_pairs, radiation_surviving_pairs])
+
+
+@instrument_stage
+def match_extremophile_ranges(planet_lower, strain_lower, planet_upper=None, strain_upper=None) -> (np.ndarray,
+                                                                                                     np.ndarray):
+    """
+    Find every (planet, strain) pair where planet_lower <= strain_lower and, when upper bounds are given,
+    strain_upper <= planet_upper, without building the planet x strain cross product.
+    The planets are sorted on their lower bound once and each strain finds its candidates with a binary search. With
+    upper bounds the candidates are the first planets of that order, which split into at most one aligned block per
+    level of build_upper_bound_levels; each block is sorted on the upper bound, so a second binary search per block
+    finds the planets reaching strain_upper and a strain costs O(log^2 planets) plus the pairs it matches.
+    :param planet_lower: array with the lower bound (or the single value) of each planet.
+    :param strain_lower: array with the value each strain has to reach or exceed.
+    :param planet_upper: optional array with the upper bound of each planet.
+    :param strain_upper: optional array with the upper bound of each strain.
+    :return: planet positions and strain positions of the matching pairs, ordered by strain and then by planet.
+    >>> match_extremophile_ranges(np.array([3.0, 1.0, 2.0]), np.array([2.0, 0.5, 3.0]))
+    (array([1, 2, 0, 1, 2]), array([0, 0, 2, 2, 2]))
+    >>> match_extremophile_ranges(np.array([250.0, 270.0]), np.array([280.0]),
+    ...                           np.array([300.0, 290.0]), np.array([295.0]))
+    (array([0]), array([0]))
+    >>> rng = np.random.default_rng(0)
+    >>> planet_lower, strain_lower = rng.uniform(0, 100, 20000), rng.uniform(0, 100, 300)
+    >>> planet_upper, strain_upper = planet_lower + rng.uniform(0, 30, 20000), strain_lower + rng.uniform(0, 10, 300)
+    >>> # the pairs the pandasql join of the cross product returned
+    >>> expected_strains, expected_planets = np.nonzero((planet_lower <= strain_lower[:, np.newaxis]) &
+    ...                                                 (strain_upper[:, np.newaxis] <= planet_upper))
+    >>> planet_positions, strain_positions = match_extremophile_ranges(planet_lower, strain_lower, planet_upper,
+    ...                                                                strain_upper)
+    >>> np.array_equal(planet_positions, expected_planets), np.array_equal(strain_positions, expected_strains)
+    (True, True)
+    """
+    planet_lower = np.asarray(planet_lower, dtype=float)
+    strain_lower = np.asarray(strain_lower, dtype=float)
+    # missing values sort to the end and never satisfy a comparison, as in SQL
+    planets_by_lower_bound = np.argsort(planet_lower, kind='stable')
+    candidate_counts = np.searchsorted(planet_lower[planets_by_lower_bound], strain_lower, side='right')
+    candidate_counts[np.isnan(strain_lower)] = 0
+    if strain_upper is not None:
+        planet_upper = np.asarray(planet_upper, dtype=float)
+        strain_upper = np.asarray(strain_upper, dtype=float)
+        levels = build_upper_bound_levels(planet_upper[planets_by_lower_bound])
+    planet_positions = []
+    strain_positions = []
+    for strain_position, candidate_count in enumerate(candidate_counts.tolist()):
+        if strain_upper is None:
+            candidates = planets_by_lower_bound[:candidate_count]
+        else:
+            candidates = planets_by_lower_bound[
+                query_upper_bound_levels(levels, candidate_count, strain_upper[strain_position])]
+        if len(candidates):
+            planet_positions.append(np.sort(candidates))
+            strain_positions.append(np.full(len(candidates), strain_position))
+    if not planet_positions:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(planet_positions), np.concatenate(strain_positions)
+
+
+def build_upper_bound_levels(upper: np.ndarray, smallest_level: int = 6) -> list:
+    """
+    Sort the aligned blocks of 2 ** level values of an array, for every level from smallest_level up, so that the
+    values at least a bound within the first n of them are found with one binary search per set bit of n.
+    :param upper: array of upper bounds, in the order the prefixes are taken.
+    :param smallest_level: prefixes shorter than 2 ** smallest_level are scanned instead of searched.
+    :return: list of (level, sorted values, their positions in upper) from the largest level down, followed by upper.
+    """
+    levels = []
+    values = np.where(np.isnan(upper), -np.inf, upper)
+    positions = np.arange(len(upper))
+    level = smallest_level
+    while 2 ** level <= len(upper):
+        block_size = 2 ** level
+        blocked = len(upper) // block_size * block_size
+        # missing upper bounds sort first so a search never lands past them, and are masked on the way out; above
+        # smallest_level a block is two sorted blocks of the level below, which the stable sort merges in one pass
+        blocks = values[:blocked].reshape(-1, block_size)
+        order = np.argsort(blocks, axis=1, kind='stable')
+        values = np.concatenate([np.take_along_axis(blocks, order, axis=1).ravel(), values[blocked:]])
+        positions = np.concatenate([np.take_along_axis(positions[:blocked].reshape(-1, block_size), order,
+                                                       axis=1).ravel(), positions[blocked:]])
+        levels.insert(0, (level, values[:blocked], positions[:blocked]))
+        level += 1
+    return levels + [upper]
+
+
+def query_upper_bound_levels(levels: list, prefix_length: int, bound: float) -> np.ndarray:
+    """
+    Find the positions among the first prefix_length values whose value is at least bound.
+    :param levels: list returned by build_upper_bound_levels.
+    :param prefix_length: number of values taken into account.
+    :param bound: value to reach or exceed.
+    :return: positions in no particular order.
+    >>> upper = np.array([5.0, 1.0, 7.0, 3.0, 9.0])
+    >>> np.sort(query_upper_bound_levels(build_upper_bound_levels(upper, smallest_level=1), 4, 3.0))
+    array([0, 2, 3])
+    """
+    *blocks, upper = levels
+    if np.isnan(bound):
+        return np.empty(0, dtype=np.intp)
+    found = []
+    start = 0
+    for level, sorted_values, positions in blocks:
+        block_size = 2 ** level
+        if prefix_length - start >= block_size:
+            block = slice(start, start + block_size)
+            first = start + np.searchsorted(sorted_values[block], bound, side='left')
+            found.append(positions[first:start + block_size])
+            start += block_size
+    # fewer than 2 ** smallest_level values are left
+    tail = np.arange(start, prefix_length)
+    found.append(tail[upper[start:prefix_length] >= bound])
+    result = np.concatenate(found)
+    return result[~np.isnan(upper[result])]
+
+
+@instrument_stage
+def surviving_pairs_to_dataframe(planet_names, strain_names, planet_positions, strain_positions) -> pd.DataFrame:
+    """
+    Turn matched (planet, strain) positions into a table of planet and strain names.
+    :param planet_names: array with the name of each planet.
+    :param strain_names: array with the name of each strain.
+    :param planet_positions: positions of the matched planets.
+    :param strain_positions: positions of the matched strains.
+    :return: dataframe with P_NAME and Strain columns, one row per surviving pair.
+    >>> surviving_pairs_to_dataframe(np.array(['K2-18 b', 'GJ 357 b']), np.array(['Humans']), [1, 0], [0, 0])
+         P_NAME  Strain
+    0  GJ 357 b  Humans
+    1   K2-18 b  Humans
+    """
+    return pd.DataFrame({'P_NAME': np.asarray(planet_names, dtype=object)[planet_positions],
+                         'Strain': np.asarray(strain_names, dtype=object)[strain_positions]})
 
 
+@instrument_stage
+def convert_to_si_units(exoplanets: pd.DataFrame, out: np.ndarray = None, dtype=np.float64) -> pd.DataFrame:
+    """
+    Convert mass, radius, density and flux from earth units to SI units and calculate the surface pressure, in one
+    pass over contiguous buffers.
+    :param exoplanets: dataframe with P_MASS, P_RADIUS, P_DENSITY and P_FLUX in earth units.
+    :param out: optional array of shape (5, number of planets) the results are written into, one row per column of
+    SI_UNIT_COLUMNS. Its dtype takes precedence over the dtype argument.
+    :param dtype: np.float64, or np.float32 to halve the memory of the results.
+    :return: dataframe with the SI_UNIT_COLUMNS, sharing memory with out, indexed like the input.
+    >>> earth = pd.DataFrame({'P_MASS': [1.0], 'P_RADIUS': [1.0], 'P_DENSITY': [1.0], 'P_FLUX': [1.0]})
+    >>> convert_to_si_units(earth)
+             P_MASS   P_RADIUS  P_DENSITY  P_FLUX  P_PRESSURE
+    0  5.974000e+24  6378000.0     5516.0  1373.0    1.081276
+    >>> convert_to_si_units(earth, dtype=np.float32)['P_PRESSURE'].dtype
+    dtype('float32')
+    """
+    number_of_planets = len(exoplanets)
+    if out is None:
+        out = np.empty((len(SI_UNIT_COLUMNS), number_of_planets), dtype=dtype)
+    elif out.shape != (len(SI_UNIT_COLUMNS), number_of_planets):
+        raise ValueError("out must have shape {}, got {}".format((len(SI_UNIT_COLUMNS), number_of_planets),
+                                                                  out.shape))
+    mass, radius, density, flux, pressure = out
+    # read the columns without copying them and write the products straight into the output rows
+    for column, factor, converted in (('P_MASS', c.MASS, mass), ('P_RADIUS', c.DIAMETER / 2, radius),
+                                      ('P_DENSITY', c.DENSITY, density), ('P_FLUX', c.SOLAR_FLUX, flux)):
+        np.multiply(exoplanets[column].to_numpy(), factor, out=converted, casting='same_kind')
+    # calculate_pressure, in the same order of operations
+    radius_squared = np.square(radius)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.multiply(mass, c.G, out=pressure)
+        np.divide(pressure, radius_squared, out=pressure)
+        np.multiply(density, pressure, out=pressure)
+        np.multiply(pressure, 2, out=pressure)
+        np.multiply(pressure, 10 ** -5, out=pressure)
+    return pd.DataFrame(out.T, index=exoplanets.index, columns=SI_UNIT_COLUMNS, copy=False)
+
+
+@instrument_stage
 def calculate_pressure(density, mass, radius):
     """
     Calulates Pressure based on Pascal's Pressure Principle
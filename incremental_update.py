@@ -0,0 +1,159 @@
+"""
+Incremental refresh of the analysis when a new version of the exoplanets catalog arrives.
+
+Description:
+    A snapshot keeps the scored catalog of the last run together with a hash of the input columns of every planet
+    and the extremophiles surviving on the potentially habitable ones. When the catalog is refreshed the new rows are
+    hashed and matched to the snapshot on P_NAME, and calculate_ESI, the habitable zone and ESI filters, the
+    habitability classification and the extremophile matching only run on the inserted and modified planets. The
+    results of the untouched planets are carried over, so the patched snapshot holds exactly what a full run on the
+    new catalog would produce.
+"""
+
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+# per planet results stored next to the catalog columns in a snapshot
+RESULT_COLUMNS = ['P_calculated_ESI', 'P_IN_HABITABLE_ZONE', 'P_POTENTIALLY_HABITABLE', 'P_HABITABILITY_CLASS']
+
+
+def row_hashes(exoplanets: pd.DataFrame) -> np.ndarray:
+    """
+    Hash the input columns of every planet, a planet whose hash changes has to be scored again.
+    :param exoplanets: dataframe with the columns read by create_exoplanets_catalog.
+    :return: array with one 64 bit hash per row.
+    >>> planets = pd.DataFrame({'P_NAME': ['a', 'b'], 'P_MASS': [1.0, 2.0]})
+    >>> hashes = row_hashes(planets)
+    >>> bool(hashes[0] == row_hashes(planets.iloc[:1])[0]), bool(hashes[0] == hashes[1])
+    (True, False)
+    """
+    columns = [column for column in da.REQUIRED_COLUMNS if column in exoplanets.columns]
+    return pd.util.hash_pandas_object(exoplanets[columns], index=False).to_numpy()
+
+
+def _score_planets(exoplanets: pd.DataFrame) -> pd.DataFrame:
+    scored = da.calculate_ESI(exoplanets.copy())
+    scored['P_IN_HABITABLE_ZONE'] = scored.index.isin(da.get_habitable_zone_planets(scored).index)
+    scored['P_POTENTIALLY_HABITABLE'] = scored.index.isin(da.get_potentially_habitable_exoplanets(scored).index)
+    scored['P_HABITABILITY_CLASS'] = da.classify_habitability(scored)
+    return scored
+
+
+def _catalog_columns(scored: pd.DataFrame) -> list:
+    return [column for column in scored.columns if column not in RESULT_COLUMNS] + ['P_calculated_ESI']
+
+
+def _sort_surviving_pairs(pairs: pd.DataFrame, potentially_habitable_names, strain_names) -> pd.DataFrame:
+    # the order identifying_surviving_extremophiles returns: by strain, then by planet in catalog order
+    planet_rank = pd.Index(potentially_habitable_names).get_indexer(pairs['P_NAME'])
+    strain_rank = pd.Index(strain_names).get_indexer(pairs['Strain'])
+    order = np.lexsort((planet_rank, strain_rank))
+    return pairs.iloc[order].reset_index(drop=True)
+
+
+def build_snapshot(exoplanets: pd.DataFrame, extremophiles_csv) -> dict:
+    """
+    Run the full analysis once and keep what an incremental update needs.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog.
+    :param extremophiles_csv: csv file of the extremophiles and the ranges they survive.
+    :return: snapshot dictionary.
+    """
+    if not exoplanets['P_NAME'].is_unique:
+        raise ValueError("P_NAME must be unique to match planets between catalog versions")
+    scored = _score_planets(exoplanets)
+    potentially_habitable = scored.loc[scored['P_POTENTIALLY_HABITABLE'], _catalog_columns(scored)]
+    return {'catalog': scored, 'row_hashes': row_hashes(exoplanets), 'extremophiles_csv': extremophiles_csv,
+            'surviving_extremophiles': da.identifying_surviving_extremophiles(extremophiles_csv,
+                                                                              potentially_habitable)}
+
+
+def update_snapshot(snapshot: dict, exoplanets: pd.DataFrame) -> (dict, dict):
+    r"""
+    Patch a snapshot with a new version of the catalog, scoring only the planets that were inserted or modified.
+    :param snapshot: snapshot of the previous catalog, from build_snapshot or update_snapshot.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog for the new catalog.
+    :return: the patched snapshot and a dictionary with the names of the inserted, modified and deleted planets.
+    >>> planets = pd.DataFrame({'P_NAME': ['a', 'b'], 'S_NAME': ['A', 'B'], 'P_MASS': [1.0, 1.0],
+    ...                         'P_RADIUS': [1.0, 1.0], 'P_DENSITY': [1.0, 1.0], 'P_ESCAPE': [1.0, 1.0],
+    ...                         'P_TEMP_EQUIL': [288.0, 288.0], 'P_TEMP_EQUIL_MIN': [280.0, 280.0],
+    ...                         'P_TEMP_EQUIL_MAX': [300.0, 300.0], 'P_FLUX': [1.0, 1.0], 'P_DISTANCE': [1.0, 1.0],
+    ...                         'S_HZ_OPT_MIN': [0.8, 0.8], 'S_HZ_OPT_MAX': [1.6, 1.6],
+    ...                         'P_RADIUS_EST': [1.0, 1.0], 'P_MASS_EST': [1.0, 1.0]})
+    >>> snapshot = build_snapshot(planets, ".\\data\\Extremophiles Range.csv")
+    >>> refreshed = planets.assign(P_TEMP_EQUIL=[288.0, 900.0])
+    >>> snapshot, changes = update_snapshot(snapshot, refreshed)
+    >>> changes['modified'], snapshot['catalog']['P_POTENTIALLY_HABITABLE'].tolist()
+    (['b'], [True, False])
+    """
+    if not exoplanets['P_NAME'].is_unique:
+        raise ValueError("P_NAME must be unique to match planets between catalog versions")
+    previous = snapshot['catalog']
+    new_hashes = row_hashes(exoplanets)
+    previous_positions = pd.Index(previous['P_NAME']).get_indexer(exoplanets['P_NAME'])
+    inserted = previous_positions == -1
+    modified = ~inserted & (snapshot['row_hashes'][np.maximum(previous_positions, 0)] != new_hashes)
+    changed = inserted | modified
+    deleted_names = previous['P_NAME'][~previous['P_NAME'].isin(exoplanets['P_NAME'])].tolist()
+
+    # carry the results of the untouched planets over and score the others
+    rescored = _score_planets(exoplanets.loc[changed])
+    scored = exoplanets.copy()
+    for column in RESULT_COLUMNS:
+        values = np.empty(len(scored), dtype=object)
+        values[~changed] = previous[column].to_numpy()[previous_positions[~changed]]
+        values[changed] = rescored[column].to_numpy()
+        scored[column] = pd.Series(values, index=scored.index).astype(previous[column].dtype)
+
+    # drop the pairs of changed and deleted planets and match the changed planets that are potentially habitable
+    stale_names = set(deleted_names).union(exoplanets['P_NAME'][changed])
+    rescored_potentially_habitable = rescored.loc[rescored['P_POTENTIALLY_HABITABLE'], _catalog_columns(rescored)]
+    fresh_pairs = da.identifying_surviving_extremophiles(snapshot['extremophiles_csv'],
+                                                         rescored_potentially_habitable)
+    strain_names = pd.read_csv(snapshot['extremophiles_csv'], usecols=['Strain'])['Strain']
+    potentially_habitable_names = scored.loc[scored['P_POTENTIALLY_HABITABLE'], 'P_NAME']
+    surviving_extremophiles = tuple(
+        _sort_surviving_pairs(pd.concat([previous_pairs.loc[~previous_pairs['P_NAME'].isin(stale_names)],
+                                         new_pairs]), potentially_habitable_names, strain_names)
+        for previous_pairs, new_pairs in zip(snapshot['surviving_extremophiles'], fresh_pairs))
+
+    changes = {'inserted': exoplanets['P_NAME'][inserted].tolist(),
+               'modified': exoplanets['P_NAME'][modified].tolist(), 'deleted': deleted_names}
+    return {'catalog': scored, 'row_hashes': new_hashes, 'extremophiles_csv': snapshot['extremophiles_csv'],
+            'surviving_extremophiles': surviving_extremophiles}, changes
+
+
+def snapshot_results(snapshot: dict) -> dict:
+    """
+    Read the results of the analysis out of a snapshot, in the shapes the data_analysis functions return them.
+    :param snapshot: snapshot from build_snapshot or update_snapshot.
+    :return: dictionary with the scored catalog, the planets in the habitable zone, the potentially habitable
+    planets, the conservative and optimistic habitable zone planets and the three surviving extremophiles tables.
+    """
+    scored = snapshot['catalog']
+    catalog = scored[_catalog_columns(scored)]
+    planets_in_habitable_zone = catalog.loc[scored['P_IN_HABITABLE_ZONE'].to_numpy(dtype=bool)]
+    return {'catalog': catalog,
+            'planets_in_habitable_zone': planets_in_habitable_zone,
+            'potentially_habitable_exoplanets': catalog.loc[scored['P_POTENTIALLY_HABITABLE'].to_numpy(dtype=bool)],
+            'habitability_type': da.identify_habitability_type(planets_in_habitable_zone),
+            'surviving_extremophiles': snapshot['surviving_extremophiles']}
+
+
+def save_snapshot(snapshot: dict, file_name):
+    """
+    Store a snapshot on disk.
+    :param snapshot: snapshot from build_snapshot or update_snapshot.
+    :param file_name: file to write.
+    """
+    pd.to_pickle(snapshot, file_name)
+
+
+def load_snapshot(file_name) -> dict:
+    """
+    Read a snapshot stored by save_snapshot.
+    :param file_name: file written by save_snapshot.
+    :return: snapshot dictionary.
+    """
+    return pd.read_pickle(file_name)
@@ -0,0 +1,229 @@
+"""
+Per stage timings, row counts and memory of the functions of data_analysis.py.
+
+Description:
+    The public functions of data_analysis.py are wrapped by instrument_stage. While no recording is active the
+    wrapper only checks one module variable and calls the function. While a recording is active every call is
+    attributed to its stack of stages, e.g. identifying_surviving_extremophiles;match_surviving_extremophiles, with
+    the number of calls, the wall and self time, the rows going in and out and, through tracemalloc, the bytes
+    allocated and the peak of traced memory above the start of the stage. cProfile can run alongside for a function
+    level view.
+
+    A recording is written as <prefix>.json with one entry per stack of stages, <prefix>.collapsed with the self time
+    of each stack in microseconds, the collapsed stack format read by flamegraph.pl and speedscope, and
+    <prefix>.prof with the cProfile statistics when profiling.
+
+    On Python 3.8, which has no tracemalloc.reset_peak, the peak of a stage is the peak of the recording so far.
+
+Direction to record a run:
+    1. EXOPLANETS_INSTRUMENTATION=run python data_analysis.py writes run.json and run.collapsed when the run ends,
+       EXOPLANETS_PROFILE=1 adds run.prof. Worker processes started by the run write their own
+       run.<pid>.json and run.<pid>.collapsed instead of overwriting the files of the run.
+    2. In code, with instrumentation('run', profile=True) as recording: ... records the calls inside the block,
+       recording.to_dict() returns the results without writing files when no prefix is given.
+"""
+
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import time
+import tracemalloc
+
+# output prefix enabling a recording of the whole process, and whether it also runs cProfile
+ENVIRONMENT_VARIABLE = 'EXOPLANETS_INSTRUMENTATION'
+PROFILE_ENVIRONMENT_VARIABLE = 'EXOPLANETS_PROFILE'
+# set to the pid of the process recording under the plain prefix, its worker processes add their own pid to it
+OWNER_ENVIRONMENT_VARIABLE = 'EXOPLANETS_INSTRUMENTATION_OWNER'
+# recording the wrapped functions report to, None while nothing is recorded
+_recording = None
+
+
+def _count_rows(value):
+    if isinstance(value, (tuple, list)):
+        counts = [_count_rows(item) for item in value]
+        return sum(counts) if counts and None not in counts else None
+    if hasattr(value, 'shape') and len(getattr(value, 'shape')):
+        return int(value.shape[0])
+    return None
+
+
+class Recording:
+    """
+    Statistics of the instrumented calls made while it is active.
+    >>> recording = Recording(trace_memory=False)
+    >>> recording.run('outer', lambda rows: [recording.run('inner', len, (rows,), {})], ([1, 2, 3],), {})
+    [3]
+    >>> [(stage['stack'], stage['calls']) for stage in recording.to_dict()['stages']]
+    [('outer', 1), ('outer;inner', 1)]
+    """
+
+    def __init__(self, trace_memory: bool = True, profile: bool = False):
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+        self.stages = {}
+        self._frames = []
+        self._started_tracemalloc = False
+        self._start = None
+        self.wall_seconds = None
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.profiler is not None:
+            self.profiler.enable()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self._start
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def run(self, stage: str, function, arguments: tuple, keyword_arguments: dict):
+        """
+        Call a function as a stage and record it.
+        :param stage: name of the stage.
+        :param function: function to call.
+        :param arguments: positional arguments of the function.
+        :param keyword_arguments: keyword arguments of the function.
+        :return: the result of the function.
+        """
+        stack = ';'.join([frame['stack'] for frame in self._frames[-1:]] + [stage])
+        frame = {'stack': stack, 'child_seconds': 0.0}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            if self._frames:
+                # the peak of the parent so far, before the counter is restarted for this stage
+                self._frames[-1]['peak_bytes'] = max(self._frames[-1]['peak_bytes'], peak_bytes)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            frame['start_bytes'] = frame['peak_bytes'] = current_bytes
+        self._frames.append(frame)
+        start = time.perf_counter()
+        try:
+            result = function(*arguments, **keyword_arguments)
+        finally:
+            seconds = time.perf_counter() - start
+            self._frames.pop()
+            statistics = self.stages.setdefault(stack, {'stack': stack, 'stage': stage, 'calls': 0,
+                                                        'wall_seconds': 0.0, 'self_seconds': 0.0, 'rows_in': None,
+                                                        'rows_out': None, 'allocated_bytes': None,
+                                                        'peak_bytes': None})
+            statistics['calls'] += 1
+            statistics['wall_seconds'] += seconds
+            statistics['self_seconds'] += seconds - frame['child_seconds']
+            if self._frames:
+                self._frames[-1]['child_seconds'] += seconds
+            if tracing:
+                current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                frame['peak_bytes'] = max(frame['peak_bytes'], peak_bytes)
+                statistics['allocated_bytes'] = (statistics['allocated_bytes'] or 0) + current_bytes - \
+                    frame['start_bytes']
+                statistics['peak_bytes'] = max(statistics['peak_bytes'] or 0,
+                                               frame['peak_bytes'] - frame['start_bytes'])
+                if self._frames:
+                    self._frames[-1]['peak_bytes'] = max(self._frames[-1]['peak_bytes'], frame['peak_bytes'])
+        # the first dataframe or array argument is the input of every stage
+        rows_in = next((rows for rows in map(_count_rows, arguments) if rows is not None), None)
+        rows_out = _count_rows(result)
+        for key, rows in (('rows_in', rows_in), ('rows_out', rows_out)):
+            if rows is not None:
+                statistics[key] = (statistics[key] or 0) + rows
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        :return: dictionary with the wall time of the recording and the statistics of every stack of stages.
+        """
+        return {'wall_seconds': self.wall_seconds, 'trace_memory': self.trace_memory,
+                'stages': sorted(self.stages.values(), key=lambda statistics: statistics['stack'])}
+
+    def collapsed_stacks(self) -> str:
+        """
+        :return: one 'stage;stage self_microseconds' line per stack of stages, for flame graph tools.
+        """
+        return ''.join('{} {}\n'.format(statistics['stack'], int(round(statistics['self_seconds'] * 1e6)))
+                       for statistics in self.to_dict()['stages'])
+
+    def write(self, prefix: str):
+        """
+        Write the recording to prefix.json, prefix.collapsed and, when profiling, prefix.prof.
+        :param prefix: path of the files without extension.
+        """
+        with open(prefix + '.json', 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+        with open(prefix + '.collapsed', 'w') as collapsed_file:
+            collapsed_file.write(self.collapsed_stacks())
+        if self.profiler is not None:
+            self.profiler.dump_stats(prefix + '.prof')
+
+
+def instrument_stage(function):
+    """
+    Record the calls of a function as a stage while a recording is active.
+    :param function: function to wrap.
+    :return: wrapped function.
+    """
+    stage = function.__name__
+
+    @functools.wraps(function)
+    def instrumented_function(*arguments, **keyword_arguments):
+        recording = _recording
+        if recording is None:
+            return function(*arguments, **keyword_arguments)
+        return recording.run(stage, function, arguments, keyword_arguments)
+    return instrumented_function
+
+
+@contextlib.contextmanager
+def instrumentation(prefix: str = None, profile: bool = False, trace_memory: bool = True):
+    """
+    Record the instrumented calls made inside the block.
+    :param prefix: path of the output files without extension, nothing is written when None.
+    :param profile: also run cProfile.
+    :param trace_memory: also measure allocations with tracemalloc, which slows Python allocations down.
+    :return: the Recording.
+    """
+    global _recording
+    previous_recording = _recording
+    recording = Recording(trace_memory, profile)
+    recording.start()
+    _recording = recording
+    try:
+        yield recording
+    finally:
+        _recording = previous_recording
+        recording.stop()
+        if prefix is not None:
+            recording.write(prefix)
+
+
+def _record_from_environment():
+    global _recording
+    prefix = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not prefix:
+        return
+    owner = os.environ.setdefault(OWNER_ENVIRONMENT_VARIABLE, str(os.getpid()))
+    if owner != str(os.getpid()):
+        prefix = '{}.{}'.format(prefix, os.getpid())
+    _recording = Recording(profile=os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, '') not in ('', '0'))
+    _recording.start()
+
+    def write_recording(recording=_recording, pid=os.getpid()):
+        # a forked child inherits the handler, its calls were recorded in its own copy and are not the run's
+        if os.getpid() != pid:
+            return
+        recording.stop()
+        recording.write(prefix)
+    atexit.register(write_recording)
+
+
+_record_from_environment()
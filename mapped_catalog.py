@@ -0,0 +1,255 @@
+"""
+Memory-mapped binary format for the exoplanets catalog with lazy column access.
+
+Description:
+    A mapped catalog is a folder with a manifest.json and one file per column:
+        - a numeric column is a raw little endian array of its dtype, opened read-only with numpy.memmap,
+        - a string column (P_NAME, S_NAME) is a string table: the UTF-8 bytes of all its values one after the other,
+          and an int64 array of rows + 1 offsets where value i spans bytes offsets[i]:offsets[i + 1].
+    Opening a mapped catalog only reads the manifest. A column is mapped the first time it is accessed and only the
+    pages a computation touches are read from disk, so get_habitable_zone_planets on
+    catalog.frame(['P_DISTANCE', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX']) never reads the other columns. The mappings are
+    read-only and backed by the files, so every process opening the same catalog shares the pages through the page
+    cache instead of holding its own copy.
+
+Direction to convert the catalog:
+    1. python mapped_catalog.py data/phl_exoplanet_catalog.csv data/phl_exoplanet_catalog.mapped
+    2. create_exoplanets_catalog('data/phl_exoplanet_catalog.mapped') then opens the folder instead of parsing text.
+"""
+
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+MANIFEST_FILE_NAME = 'manifest.json'
+FORMAT_VERSION = 1
+STRING_COLUMNS = ('P_NAME', 'S_NAME')
+
+
+def _column_files(column: str) -> dict:
+    if column in STRING_COLUMNS:
+        return {'bytes': column + '.utf8', 'offsets': column + '.offsets.i8'}
+    return {'values': column + '.bin'}
+
+
+def convert_catalog_csv(csv_file_name, directory, chunk_size: int = da.DEFAULT_CHUNK_SIZE) -> 'MappedCatalog':
+    """
+    Convert a catalog csv file to a mapped catalog folder, a bounded number of rows at a time.
+    :param csv_file_name: path of the catalog csv file.
+    :param directory: folder to write, replaced when it exists.
+    :param chunk_size: number of rows parsed at a time.
+    :return: the MappedCatalog opened on the new folder.
+    """
+    temporary_directory = directory.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+    os.makedirs(temporary_directory)
+    files = {}
+    dtypes = {}
+    column_order = None
+    string_offsets = {}
+    rows = 0
+
+    def open_column_files(columns: list, column_dtypes: dict):
+        for column in columns:
+            files[column] = {kind: open(os.path.join(temporary_directory, file_name), 'wb')
+                             for kind, file_name in _column_files(column).items()}
+            if column in STRING_COLUMNS:
+                string_offsets[column] = 0
+                files[column]['offsets'].write(np.zeros(1, dtype='<i8').tobytes())
+            else:
+                dtypes[column] = np.dtype(column_dtypes[column]).newbyteorder('<').str
+
+    try:
+        for exoplanets_chunk in da.read_exoplanets_catalog_in_chunks(csv_file_name, chunk_size):
+            if column_order is None:
+                column_order = list(exoplanets_chunk.columns)
+                open_column_files(column_order, exoplanets_chunk.dtypes)
+            for column in column_order:
+                if column in STRING_COLUMNS:
+                    encoded = [str(value).encode('utf-8') for value in exoplanets_chunk[column]]
+                    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+                    offsets = string_offsets[column] + np.cumsum(lengths)
+                    files[column]['bytes'].write(b''.join(encoded))
+                    files[column]['offsets'].write(offsets.astype('<i8').tobytes())
+                    if len(offsets):
+                        string_offsets[column] = int(offsets[-1])
+                else:
+                    files[column]['values'].write(exoplanets_chunk[column].to_numpy(dtype=dtypes[column]).tobytes())
+            rows += len(exoplanets_chunk)
+        if column_order is None:
+            # a csv file without rows gives no chunk, write an empty catalog of the required columns
+            column_order = list(da.REQUIRED_COLUMNS)
+            open_column_files(column_order, da.CATALOG_NUMERIC_DTYPES)
+    finally:
+        for column_files in files.values():
+            for column_file in column_files.values():
+                column_file.close()
+    manifest = {'format_version': FORMAT_VERSION, 'rows': rows, 'column_order': column_order,
+                'columns': {column: {'kind': 'string' if column in STRING_COLUMNS else 'numeric',
+                                     'dtype': dtypes.get(column), 'files': _column_files(column)}
+                            for column in column_order}}
+    with open(os.path.join(temporary_directory, MANIFEST_FILE_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    # swap the finished folder in, so a reader never opens a half written catalog
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary_directory, directory)
+    return MappedCatalog(directory)
+
+
+def is_mapped_catalog(path) -> bool:
+    """
+    Check whether a path is a mapped catalog folder.
+    :param path: path to check.
+    :return: True when the path is a folder holding a manifest.
+    """
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE_NAME))
+
+
+class MappedCatalog:
+    r"""
+    Read-only view of a mapped catalog folder, mapping each column the first time it is accessed.
+    >>> import tempfile
+    >>> catalog = convert_catalog_csv(".\\data\\phl_exoplanet_catalog.csv", tempfile.mkdtemp() + "/catalog")
+    >>> len(catalog), catalog['P_NAME'].iloc[-1]
+    (4048, 'GJ 1061 d')
+    >>> len(da.get_habitable_zone_planets(catalog.frame(['P_DISTANCE', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX'])))
+    197
+    >>> catalog.mapped_columns
+    ['P_NAME', 'P_DISTANCE', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX']
+    >>> catalog.to_dataframe().equals(da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv"))
+    True
+    >>> csv_file_name = tempfile.mkdtemp() + "/blank.csv"
+    >>> blank_row = 'a' + ',' * (len(da.REQUIRED_COLUMNS) - 1)
+    >>> with open(csv_file_name, 'w') as csv_file:
+    ...     _ = csv_file.write(','.join(da.REQUIRED_COLUMNS) + '\n' + blank_row + '\n')
+    >>> convert_catalog_csv(csv_file_name, csv_file_name + ".mapped")['P_HABITABLE'].tolist()
+    [0]
+    >>> with open(csv_file_name, 'w') as csv_file:
+    ...     _ = csv_file.write(','.join(da.REQUIRED_COLUMNS) + '\n')
+    >>> empty_catalog = convert_catalog_csv(csv_file_name, csv_file_name + ".mapped")
+    >>> len(empty_catalog), empty_catalog.columns == da.REQUIRED_COLUMNS
+    (0, True)
+    >>> da.create_exoplanets_catalog(csv_file_name + ".mapped").shape
+    (0, 20)
+    >>> da.create_exoplanets_catalog(tempfile.mkdtemp())
+    Traceback (most recent call last):
+    ...
+    ValueError: ... is a folder without a mapped catalog manifest, convert the csv file with ...
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['format_version'] != FORMAT_VERSION:
+            raise ValueError("{} has format version {}, expected {}".format(directory,
+                                                                           self.manifest['format_version'],
+                                                                           FORMAT_VERSION))
+        self._mapped = {}
+
+    def __len__(self) -> int:
+        return self.manifest['rows']
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.manifest['columns']
+
+    @property
+    def columns(self) -> list:
+        return list(self.manifest['column_order'])
+
+    @property
+    def mapped_columns(self) -> list:
+        """
+        :return: the columns mapped so far, in the order they were first accessed.
+        """
+        return list(self._mapped)
+
+    def _map(self, column: str):
+        if column not in self._mapped:
+            if column not in self:
+                raise KeyError("{} is not a column of {}, use one of {}".format(column, self.directory,
+                                                                                 self.columns))
+            description = self.manifest['columns'][column]
+            paths = {kind: os.path.join(self.directory, file_name)
+                     for kind, file_name in description['files'].items()}
+            if description['kind'] == 'string':
+                offsets = np.memmap(paths['offsets'], dtype='<i8', mode='r', shape=(len(self) + 1,))
+                # an empty file can not be mapped, a column of empty strings has no bytes
+                string_bytes = np.memmap(paths['bytes'], dtype=np.uint8, mode='r') \
+                    if os.path.getsize(paths['bytes']) else np.empty(0, dtype=np.uint8)
+                self._mapped[column] = (string_bytes, offsets)
+            else:
+                self._mapped[column] = np.memmap(paths['values'], dtype=description['dtype'], mode='r',
+                                                 shape=(len(self),)) if len(self) else \
+                    np.empty(0, dtype=description['dtype'])
+        return self._mapped[column]
+
+    def values(self, column: str, positions=None) -> np.ndarray:
+        """
+        Read one column, or some rows of it.
+        :param column: name of the column.
+        :param positions: row positions to read, all rows by default.
+        :return: read-only array backed by the file for a numeric column read whole, else a new array; strings are
+        decoded to an object array.
+        """
+        mapped = self._map(column)
+        if self.manifest['columns'][column]['kind'] != 'string':
+            return mapped if positions is None else np.asarray(mapped[positions])
+        string_bytes, offsets = mapped
+        positions = np.arange(len(self)) if positions is None else np.asarray(positions)
+        starts = offsets[positions]
+        stops = offsets[positions + 1]
+        raw = string_bytes.tobytes() if positions.size == len(self) else None
+        decoded = np.empty(len(positions), dtype=object)
+        for row, (start, stop) in enumerate(zip(starts.tolist(), stops.tolist())):
+            decoded[row] = (raw[start:stop] if raw is not None else string_bytes[start:stop].tobytes()).decode('utf-8')
+        return decoded
+
+    def __getitem__(self, column: str) -> pd.Series:
+        string_column = self.manifest['columns'].get(column, {}).get('kind') == 'string'
+        return pd.Series(self.values(column), name=column, dtype='str' if string_column else None, copy=False)
+
+    def frame(self, columns: list = None) -> pd.DataFrame:
+        """
+        Build a dataframe of some columns, only those columns are mapped.
+        :param columns: names of the columns, all columns in catalog order by default.
+        :return: dataframe whose numeric columns share memory with the files.
+        """
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({column: self[column] for column in columns}, copy=False)
+
+    def take(self, positions, columns: list = None) -> pd.DataFrame:
+        """
+        Read some rows, touching only the pages holding them.
+        :param positions: row positions to read.
+        :param columns: names of the columns, all columns in catalog order by default.
+        :return: dataframe of the rows, indexed by their position in the catalog.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({column: pd.Series(self.values(column, positions), index=positions,
+                                               dtype='str' if column in STRING_COLUMNS else None)
+                             for column in columns}, index=positions)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: every column, as create_exoplanets_catalog returns them from the csv file.
+        """
+        return self.frame()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csv_file_name')
+    parser.add_argument('directory')
+    parser.add_argument('--chunk-size', type=int, default=da.DEFAULT_CHUNK_SIZE)
+    arguments = parser.parse_args()
+    mapped_catalog = convert_catalog_csv(arguments.csv_file_name, arguments.directory, arguments.chunk_size)
+    print("{} rows and {} columns written to {}".format(len(mapped_catalog), len(mapped_catalog.columns),
+                                                        arguments.directory))
@@ -0,0 +1,119 @@
+"""
+Multi-core scoring of the exoplanets catalog.
+
+Description:
+    ESI calculation, conversion to SI units and calculate_pressure only ever look at one planet at a time, so the
+    catalog can be cut into shards and scored in a pool of processes. The numeric columns are copied once into
+    shared memory, every worker reads its rows from there and writes its results into a shared output block at the
+    same rows, which keeps the merged result in the original row order no matter which shard finishes first.
+    Small catalogs are scored in the calling process, where starting a pool would cost more than it saves.
+"""
+
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+# columns read by the workers, in the order they are laid out in shared memory
+INPUT_COLUMNS = da.ESI_PROPERTY_COLUMNS + ['P_MASS', 'P_FLUX']
+# columns written by the workers, in the order they are laid out in shared memory
+OUTPUT_COLUMNS = ['P_calculated_ESI', 'P_MASS_KG', 'P_RADIUS_M', 'P_DENSITY_KG_M3', 'P_FLUX_W_M2', 'P_PRESSURE']
+# below this number of planets the catalog is scored serially
+PARALLEL_MIN_ROWS = 50000
+
+
+def _score_rows(input_columns: np.ndarray, output_columns: np.ndarray, start: int, stop: int):
+    rows = pd.DataFrame({column: input_columns[position, start:stop]
+                         for position, column in enumerate(INPUT_COLUMNS)})
+    output_columns[0, start:stop] = da.calculate_ESI(rows)['P_calculated_ESI'].to_numpy()
+    # the SI unit rows are laid out in the order convert_to_si_units writes them
+    da.convert_to_si_units(rows, out=output_columns[1:, start:stop])
+
+
+def _score_shard(input_name: str, output_name: str, number_of_planets: int, start: int, stop: int) -> int:
+    input_memory = shared_memory.SharedMemory(name=input_name)
+    output_memory = shared_memory.SharedMemory(name=output_name)
+    try:
+        input_columns = np.ndarray((len(INPUT_COLUMNS), number_of_planets), dtype=np.float64,
+                                   buffer=input_memory.buf)
+        output_columns = np.ndarray((len(OUTPUT_COLUMNS), number_of_planets), dtype=np.float64,
+                                    buffer=output_memory.buf)
+        _score_rows(input_columns, output_columns, start, stop)
+        del input_columns, output_columns
+    finally:
+        input_memory.close()
+        output_memory.close()
+    return stop - start
+
+
+def shard_bounds(number_of_planets: int, number_of_shards: int) -> list:
+    """
+    Split the rows of a catalog into contiguous shards of nearly equal size.
+    :param number_of_planets: number of rows to split.
+    :param number_of_shards: number of shards wanted.
+    :return: list of (start, stop) row ranges covering every row exactly once.
+    >>> shard_bounds(10, 3)
+    [(0, 3), (3, 6), (6, 10)]
+    """
+    number_of_shards = max(1, min(number_of_shards, number_of_planets))
+    boundaries = [shard * number_of_planets // number_of_shards for shard in range(number_of_shards + 1)]
+    return [(boundaries[shard], boundaries[shard + 1]) for shard in range(number_of_shards)]
+
+
+def score_exoplanets(exoplanets: pd.DataFrame, workers: int = None, shards_per_worker: int = 4,
+                     min_parallel_rows: int = PARALLEL_MIN_ROWS) -> pd.DataFrame:
+    """
+    Calculate the ESI, the SI unit conversions and the surface pressure of every planet, in parallel for large
+    catalogs.
+    :param exoplanets: dataframe with the columns read by create_exoplanets_catalog.
+    :param workers: number of worker processes, by default the number of CPUs. 1 always scores serially.
+    :param shards_per_worker: number of shards handed to each worker, more shards even out uneven workers.
+    :param min_parallel_rows: catalogs with fewer rows than this are scored serially.
+    :return: same input dataframe with the P_calculated_ESI, SI unit and P_PRESSURE columns added.
+    >>> planets = pd.DataFrame({'P_RADIUS': [1.0, 2.0], 'P_DENSITY': [1.0, 0.5], 'P_ESCAPE': [1.0, 1.2],
+    ...                         'P_TEMP_EQUIL': [288.0, 250.0], 'P_MASS': [1.0, 4.0], 'P_FLUX': [1.0, 0.8]})
+    >>> scored = score_exoplanets(planets, workers=2, min_parallel_rows=0)
+    >>> scored[['P_calculated_ESI', 'P_PRESSURE']].round(6)
+       P_calculated_ESI  P_PRESSURE
+    0          1.000000    1.081276
+    1          0.796661    0.540638
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    number_of_planets = len(exoplanets)
+    input_shape = (len(INPUT_COLUMNS), number_of_planets)
+    output_columns = np.empty((len(OUTPUT_COLUMNS), number_of_planets))
+    if workers <= 1 or number_of_planets < max(min_parallel_rows, 1):
+        input_columns = np.empty(input_shape)
+        for position, column in enumerate(INPUT_COLUMNS):
+            input_columns[position] = exoplanets[column].to_numpy(dtype=float)
+        _score_rows(input_columns, output_columns, 0, number_of_planets)
+    else:
+        input_memory = shared_memory.SharedMemory(create=True, size=output_columns.itemsize * input_shape[0]
+                                                  * input_shape[1])
+        output_memory = shared_memory.SharedMemory(create=True, size=output_columns.nbytes)
+        try:
+            shared_input = np.ndarray(input_shape, dtype=np.float64, buffer=input_memory.buf)
+            shared_output = np.ndarray(output_columns.shape, dtype=np.float64, buffer=output_memory.buf)
+            for position, column in enumerate(INPUT_COLUMNS):
+                shared_input[position] = exoplanets[column].to_numpy(dtype=float)
+            shards = shard_bounds(number_of_planets, workers * shards_per_worker)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_score_shard, input_memory.name, output_memory.name, number_of_planets,
+                                           start, stop) for start, stop in shards]
+                for future in futures:
+                    future.result()
+            output_columns[:] = shared_output
+            del shared_input, shared_output
+        finally:
+            input_memory.close()
+            input_memory.unlink()
+            output_memory.close()
+            output_memory.unlink()
+    for position, column in enumerate(OUTPUT_COLUMNS):
+        exoplanets[column] = output_columns[position]
+    return exoplanets
@@ -0,0 +1,138 @@
+"""
+Sensitivity of the potentially habitable planets to the ESI reference values, weight exponents and threshold.
+
+Description:
+    calculate_ESI multiplies the similarity terms of the density, escape velocity and temperature of every planet,
+    each raised to its weight exponent, and get_potentially_habitable_exoplanets keeps the planets whose ESI is at
+    least 0.6. Taking logarithms turns this into a weighted sum: a planet is potentially habitable when
+    sum(weight * log(term)) >= NUMBER_OF_PARAMETERS_TO_CALCULATE_ESI * log(threshold). The logarithm of each term is
+    computed once per planet and reference value, and a whole block of configurations is then scored against the
+    catalog with one broadcast multiply and add per property. Only the membership of each configuration is kept, as
+    a packed bit row, next to its count and its differences with the current constants.
+"""
+
+
+import numpy as np
+import pandas as pd
+import constants as c
+import data_analysis as da
+
+# properties used by calculate_ESI with the constants that set their reference value and weight exponent, the radius
+# term is not part of the index
+SWEEP_PROPERTIES = [('P_DENSITY', 'REFERENCE_VALUE_DENSITY', 'WEIGHT_EXPONENT_DENSITY'),
+                    ('P_ESCAPE', 'REFERENCE_VALUE_VELOCITY', 'WEIGHT_EXPONENT_VELOCITY'),
+                    ('P_TEMP_EQUIL', 'REFERENCE_VALUE_TEMPERATURE', 'WEIGHT_EXPONENT_TEMPERATURE')]
+SWEEP_PARAMETERS = [name for _, reference, weight in SWEEP_PROPERTIES for name in (reference, weight)] + ['THRESHOLD']
+# ESI threshold of get_potentially_habitable_exoplanets
+DEFAULT_THRESHOLD = 0.6
+# number of configuration x planet scores held in memory at a time
+SWEEP_BLOCK_VALUES = 2 ** 22
+
+
+def _default_value(name: str) -> float:
+    return DEFAULT_THRESHOLD if name == 'THRESHOLD' else getattr(c, name)
+
+
+def parameter_grid(**values) -> pd.DataFrame:
+    """
+    Build every combination of the given parameter values, the others keep their value from constants.py.
+    :param values: name from SWEEP_PARAMETERS mapped to a value or a list of values.
+    :return: dataframe with one configuration per row and one column per parameter.
+    >>> grid = parameter_grid(WEIGHT_EXPONENT_TEMPERATURE=[5.58, 4.0], THRESHOLD=[0.6, 0.7, 0.8])
+    >>> len(grid), grid.loc[5, ['WEIGHT_EXPONENT_TEMPERATURE', 'THRESHOLD']].tolist()
+    (6, [4.0, 0.8])
+    """
+    unknown = sorted(set(values) - set(SWEEP_PARAMETERS))
+    if unknown:
+        raise ValueError("{} can not be swept, use one of {}".format(unknown, SWEEP_PARAMETERS))
+    axes = [np.atleast_1d(np.asarray(values.get(name, _default_value(name)), dtype=float))
+            for name in SWEEP_PARAMETERS]
+    return pd.DataFrame({name: axis.ravel() for name, axis in zip(SWEEP_PARAMETERS,
+                                                                  np.meshgrid(*axes, indexing='ij'))})
+
+
+def _log_terms(exoplanets: pd.DataFrame, grid: pd.DataFrame) -> list:
+    # one row of log similarity terms per distinct reference value, and the row each configuration uses
+    log_terms = []
+    for column, reference_name, weight_name in SWEEP_PROPERTIES:
+        references, configuration_rows = np.unique(grid[reference_name].to_numpy(dtype=float), return_inverse=True)
+        terms = da.calculate_similarity_term(exoplanets[column].to_numpy(dtype=float)[np.newaxis, :],
+                                             references[:, np.newaxis], 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_terms.append((np.log(terms), configuration_rows.ravel(), grid[weight_name].to_numpy(dtype=float)))
+    return log_terms
+
+
+def _potentially_habitable(log_terms: list, log_thresholds: np.ndarray, start: int, stop: int) -> np.ndarray:
+    score = 0.0
+    for property_log_terms, configuration_rows, weights in log_terms:
+        weight = weights[start:stop, np.newaxis]
+        with np.errstate(invalid='ignore'):
+            contribution = weight * property_log_terms[configuration_rows[start:stop]]
+        # a term raised to the power 0 is 1, even when it is 0 or missing
+        score = score + np.where(weight == 0, 0.0, contribution)
+    return score >= log_thresholds[start:stop, np.newaxis]
+
+
+def sweep_potentially_habitable(exoplanets: pd.DataFrame, grid: pd.DataFrame, block_size: int = None) -> dict:
+    r"""
+    Find the potentially habitable planets of every configuration of a parameter grid.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog.
+    :param grid: configurations from parameter_grid, missing parameters keep their value from constants.py.
+    :param block_size: number of configurations scored at a time, by default enough to fill SWEEP_BLOCK_VALUES.
+    :return: dictionary with the grid extended with the COUNT, ADDED and REMOVED of each configuration, the
+    membership of each configuration as packed bit rows, the row positions of the planets potentially habitable
+    under the current constants and, per configuration, the row positions added to and removed from them.
+    >>> exoplanets = da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")
+    >>> sweep = sweep_potentially_habitable(exoplanets, parameter_grid(THRESHOLD=[0.6, 0.7, 0.8]))
+    >>> sweep['grid'][['THRESHOLD', 'COUNT', 'ADDED', 'REMOVED']]
+       THRESHOLD  COUNT  ADDED  REMOVED
+    0        0.6     27      0        0
+    1        0.7     11      0       16
+    2        0.8      4      0       23
+    >>> exoplanets['P_NAME'].iloc[sweep_members(sweep, 2)].tolist()
+    ['K2-18 b', 'TRAPPIST-1 c', 'TRAPPIST-1 d', 'TRAPPIST-1 e']
+    """
+    grid = grid.copy()
+    for name in SWEEP_PARAMETERS:
+        if name not in grid.columns:
+            grid[name] = _default_value(name)
+    number_of_planets = len(exoplanets)
+    number_of_configurations = len(grid)
+    if block_size is None:
+        block_size = max(1, SWEEP_BLOCK_VALUES // max(number_of_planets, 1))
+    with np.errstate(divide='ignore'):
+        log_thresholds = c.NUMBER_OF_PARAMETERS_TO_CALCULATE_ESI * np.log(grid['THRESHOLD'].to_numpy(dtype=float))
+
+    # the current constants are scored the same way, so differences never come from rounding
+    baseline_grid = parameter_grid()
+    baseline = _potentially_habitable(_log_terms(exoplanets, baseline_grid),
+                                      c.NUMBER_OF_PARAMETERS_TO_CALCULATE_ESI * np.log([DEFAULT_THRESHOLD]), 0, 1)[0]
+
+    log_terms = _log_terms(exoplanets, grid)
+    membership = np.empty((number_of_configurations, (number_of_planets + 7) // 8), dtype=np.uint8)
+    counts = np.empty(number_of_configurations, dtype=np.int64)
+    added = []
+    removed = []
+    for start in range(0, number_of_configurations, block_size):
+        stop = min(start + block_size, number_of_configurations)
+        members = _potentially_habitable(log_terms, log_thresholds, start, stop)
+        membership[start:stop] = np.packbits(members, axis=1)
+        counts[start:stop] = np.count_nonzero(members, axis=1)
+        added.extend(np.flatnonzero(row) for row in members & ~baseline)
+        removed.extend(np.flatnonzero(row) for row in baseline & ~members)
+    grid['COUNT'] = counts
+    grid['ADDED'] = [len(positions) for positions in added]
+    grid['REMOVED'] = [len(positions) for positions in removed]
+    return {'grid': grid, 'membership': membership, 'number_of_planets': number_of_planets,
+            'baseline': np.flatnonzero(baseline), 'added': added, 'removed': removed}
+
+
+def sweep_members(sweep: dict, configuration: int) -> np.ndarray:
+    """
+    Unpack the potentially habitable planets of one configuration.
+    :param sweep: dictionary returned by sweep_potentially_habitable.
+    :param configuration: row of the configuration in the grid.
+    :return: row positions of the planets, in catalog order.
+    """
+    return np.flatnonzero(np.unpackbits(sweep['membership'][configuration], count=sweep['number_of_planets']))
@@ -0,0 +1,341 @@
+"""
+Content addressed result cache for the stages of the analysis pipeline.
+
+Description:
+    Every stage of data_analysis.py is a pure function of its inputs and of some values from constants.py. The key
+    of a cached result combines the name of the stage, a fingerprint of its inputs (size, modification time and hash
+    of a file, or a hash of the contents of a dataframe), the constants the stage reads and the code of the stage:
+    the source of the stage function and of every data_analysis.py function it calls, directly or not, and
+    STAGE_CODE_VERSION. A result is reused for as long as none of them change. Results are kept in memory, least
+    recently used first out once a byte budget is exceeded, and on disk, where the least recently used files are
+    removed once the folder grows past its own budget.
+
+    run_cached_analysis chains the keys of the stages instead of hashing intermediate dataframes: the key of each
+    stage is built from the keys of the stages it consumes. Changing a weight exponent therefore changes the key of
+    calculate_ESI and of everything downstream of it, while the parsed catalog is still served from the cache.
+"""
+
+
+import ast
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from collections import OrderedDict
+
+import pandas as pd
+import constants as c
+import data_analysis as da
+from catalog_cache import catalog_fingerprint
+
+# values of constants.py read by each stage, a change in any of them invalidates the stage
+STAGE_CONSTANTS = {
+    'create_exoplanets_catalog': [],
+    'calculate_ESI': ['REFERENCE_VALUE_RADIUS', 'REFERENCE_VALUE_DENSITY', 'REFERENCE_VALUE_VELOCITY',
+                      'REFERENCE_VALUE_TEMPERATURE', 'WEIGHT_EXPONENT_RADIUS', 'WEIGHT_EXPONENT_DENSITY',
+                      'WEIGHT_EXPONENT_VELOCITY', 'WEIGHT_EXPONENT_TEMPERATURE',
+                      'NUMBER_OF_PARAMETERS_TO_CALCULATE_ESI'],
+    'get_habitable_zone_planets': [],
+    'get_potentially_habitable_exoplanets': [],
+    'identify_habitability_type': [],
+    'identifying_surviving_extremophiles': ['MASS', 'DIAMETER', 'DENSITY', 'SOLAR_FLUX', 'G'],
+    'calculate_pressure': ['G'],
+}
+# bumped when a stage changes without its source in data_analysis.py changing, e.g. a change of the pickled format
+STAGE_CODE_VERSION = 1
+DEFAULT_CACHE_DIRECTORY = '.pipeline_cache'
+DEFAULT_MAX_MEMORY_BYTES = 512 * 1024 ** 2
+DEFAULT_MAX_DISK_BYTES = 2 * 1024 ** 3
+
+
+def _result_size(value) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) \
+            else int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(_result_size(item) for item in value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _copy_result(value):
+    # stages such as calculate_ESI modify their input, callers get their own copy of a cached result
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy_result(item) for item in value)
+    return value
+
+
+class ResultCache:
+    """
+    Two level cache of stage results: an LRU dictionary in memory backed by pickle files on disk.
+    >>> import tempfile
+    >>> cache = ResultCache(tempfile.mkdtemp())
+    >>> cache.put('key', pd.DataFrame({'P_NAME': ['K2-18 b']}))
+    >>> ResultCache(cache.directory).get('key')
+    (True,     P_NAME
+    0  K2-18 b)
+    >>> cache.get('missing')
+    (False, None)
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _remember(self, key: str, value):
+        size = _result_size(value)
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def get(self, key: str) -> (bool, object):
+        """
+        Look a result up in memory, then on disk.
+        :param key: key of the result.
+        :return: whether the result was found and a copy of it.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return True, _copy_result(self._memory[key][0])
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), 'rb') as result_file:
+                    value = pickle.load(result_file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                # a file removed or cut short by another process counts as a miss
+                self.stats['misses'] += 1
+                return False, None
+            # touch the file so disk eviction sees it as recently used
+            os.utime(self._path(key))
+            self._remember(key, value)
+            self.stats['disk_hits'] += 1
+            return True, _copy_result(value)
+        self.stats['misses'] += 1
+        return False, None
+
+    def put(self, key: str, value):
+        """
+        Store a result in memory and on disk.
+        :param key: key of the result.
+        :param value: result to store, a copy is kept.
+        """
+        value = _copy_result(value)
+        self._remember(key, value)
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(key) + '.tmp', 'wb') as result_file:
+            pickle.dump(value, result_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self._path(key) + '.tmp', self._path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.pkl'):
+                file_status = os.stat(os.path.join(self.directory, file_name))
+                entries.append((file_status.st_mtime_ns, file_status.st_size, file_name))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except OSError:
+                continue
+            total_bytes -= size
+
+    def clear(self):
+        """
+        Remove every result from memory and disk.
+        """
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self.directory is not None and os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                if file_name.endswith('.pkl'):
+                    os.remove(os.path.join(self.directory, file_name))
+
+
+default_cache = ResultCache()
+
+
+def fingerprint(argument) -> str:
+    """
+    Fingerprint an input of a stage.
+    :param argument: path of an existing file, dataframe, series or plain value.
+    :return: text that changes whenever the input changes.
+    >>> fingerprint(pd.DataFrame({'P_MASS': [1.0]})) == fingerprint(pd.DataFrame({'P_MASS': [1.0]}))
+    True
+    >>> fingerprint(pd.DataFrame({'P_MASS': [1.0]})) == fingerprint(pd.DataFrame({'P_MASS': [2.0]}))
+    False
+    """
+    if isinstance(argument, (pd.DataFrame, pd.Series)):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(argument, index=True).to_numpy().tobytes())
+        if isinstance(argument, pd.DataFrame):
+            digest.update(json.dumps([list(map(str, argument.columns)),
+                                      list(map(str, argument.dtypes))]).encode('utf-8'))
+        return 'frame:' + digest.hexdigest()
+    if isinstance(argument, (str, os.PathLike)) and os.path.isfile(argument):
+        file_fingerprint = catalog_fingerprint(argument, required_columns=[])
+        return 'file:{sha256}:{size}'.format(**file_fingerprint)
+    return 'value:' + repr(argument)
+
+
+@functools.lru_cache(maxsize=None)
+def _data_analysis_functions() -> dict:
+    source = inspect.getsource(da)
+    module = ast.parse(source)
+    functions = {}
+    for node in module.body:
+        if isinstance(node, ast.FunctionDef):
+            called = {name.id for name in ast.walk(node) if isinstance(name, ast.Name)}
+            functions[node.name] = (ast.get_source_segment(source, node), called)
+    return functions
+
+
+@functools.lru_cache(maxsize=None)
+def stage_code_fingerprint(function_name: str) -> str:
+    """
+    Fingerprint the code of a stage.
+    :param function_name: name of a function in data_analysis.py.
+    :return: hash of STAGE_CODE_VERSION and of the source of the function and of every function of data_analysis.py
+    it calls, directly or through other functions.
+    >>> stage_code_fingerprint('calculate_ESI') == stage_code_fingerprint('calculate_ESI')
+    True
+    >>> stage_code_fingerprint('calculate_ESI') == stage_code_fingerprint('get_habitable_zone_planets')
+    False
+    """
+    functions = _data_analysis_functions()
+    reached = set()
+    waiting = [function_name]
+    while waiting:
+        name = waiting.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+        waiting.extend(called for called in functions[name][1] if called in functions)
+    digest = hashlib.sha256(str(STAGE_CODE_VERSION).encode('utf-8'))
+    for name in sorted(reached):
+        digest.update(functions[name][0].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stage_key(function_name: str, input_keys) -> str:
+    """
+    Build the key of a stage result from the stage, its code, the fingerprints or keys of its inputs and its
+    constants.
+    :param function_name: name of a function in data_analysis.py listed in STAGE_CONSTANTS.
+    :param input_keys: fingerprints of the inputs, or keys of the stages they come from.
+    :return: hexadecimal key.
+    """
+    constants = {name: getattr(c, name) for name in STAGE_CONSTANTS[function_name]}
+    description = json.dumps({'function': function_name, 'code': stage_code_fingerprint(function_name),
+                              'inputs': list(input_keys), 'constants': constants}, sort_keys=True)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+def _cached(function_name: str, key: str, arguments, cache: ResultCache):
+    found, value = cache.get(key)
+    if not found:
+        value = getattr(da, function_name)(*arguments)
+        cache.put(key, value)
+    return value
+
+
+def cached_call(function_name: str, *arguments, cache: ResultCache = None):
+    """
+    Call a stage of data_analysis.py through the cache, fingerprinting its inputs.
+    :param function_name: name of a function in data_analysis.py listed in STAGE_CONSTANTS.
+    :param arguments: arguments of the function.
+    :param cache: ResultCache to use, the module default by default.
+    :return: the result of the function, a copy when it comes from the cache.
+    """
+    cache = default_cache if cache is None else cache
+    key = stage_key(function_name, [fingerprint(argument) for argument in arguments])
+    # hand the function a copy so a stage that modifies its input leaves the caller's dataframe alone
+    return _cached(function_name, key, [_copy_result(argument) for argument in arguments], cache)
+
+
+def run_cached_analysis(exoplanets_csv, extremophiles_csv, cache: ResultCache = None) -> dict:
+    r"""
+    Run the analysis of the main program, serving every stage whose inputs and constants are unchanged from the
+    cache.
+    :param exoplanets_csv: exoplanet catalog csv file.
+    :param extremophiles_csv: extremophiles csv file.
+    :param cache: ResultCache to use, the module default by default.
+    :return: dictionary with the result of every stage.
+    >>> import tempfile
+    >>> cache = ResultCache(tempfile.mkdtemp())
+    >>> results = run_cached_analysis(".\\data\\phl_exoplanet_catalog.csv", ".\\data\\Extremophiles Range.csv", cache)
+    >>> results = run_cached_analysis(".\\data\\phl_exoplanet_catalog.csv", ".\\data\\Extremophiles Range.csv", cache)
+    >>> cache.stats
+    {'memory_hits': 5, 'disk_hits': 0, 'misses': 6}
+    >>> weight_exponent_density = c.WEIGHT_EXPONENT_DENSITY
+    >>> c.WEIGHT_EXPONENT_DENSITY = 1.0
+    >>> results = run_cached_analysis(".\\data\\phl_exoplanet_catalog.csv", ".\\data\\Extremophiles Range.csv", cache)
+    >>> c.WEIGHT_EXPONENT_DENSITY = weight_exponent_density
+    >>> cache.stats
+    {'memory_hits': 6, 'disk_hits': 0, 'misses': 11}
+    """
+    cache = default_cache if cache is None else cache
+    catalog_key = stage_key('create_exoplanets_catalog', [fingerprint(exoplanets_csv)])
+    esi_key = stage_key('calculate_ESI', [catalog_key])
+    habitable_zone_key = stage_key('get_habitable_zone_planets', [esi_key])
+    potentially_habitable_key = stage_key('get_potentially_habitable_exoplanets', [esi_key])
+    habitability_type_key = stage_key('identify_habitability_type', [habitable_zone_key])
+    extremophiles_key = stage_key('identifying_surviving_extremophiles',
+                                  [fingerprint(extremophiles_csv), potentially_habitable_key])
+
+    # each stage reads its input from the cache only when it actually has to run, and only once per run
+    results = {}
+
+    def stage(function_name, key, *input_stages):
+        if key in results:
+            return results[key]
+        found, value = cache.get(key)
+        if not found:
+            value = getattr(da, function_name)(*[input_stage() if callable(input_stage) else input_stage
+                                                  for input_stage in input_stages])
+            cache.put(key, value)
+        results[key] = value
+        return value
+
+    def catalog():
+        return stage('create_exoplanets_catalog', catalog_key, exoplanets_csv)
+
+    def all_exoplanets_with_esi():
+        # calculate_ESI adds its column to the dataframe it is given, keep the cached catalog untouched
+        return stage('calculate_ESI', esi_key, lambda: _copy_result(catalog()))
+
+    def planets_in_habitable_zone():
+        return stage('get_habitable_zone_planets', habitable_zone_key, all_exoplanets_with_esi)
+
+    def potentially_habitable_exoplanets():
+        return stage('get_potentially_habitable_exoplanets', potentially_habitable_key, all_exoplanets_with_esi)
+
+    return {'all_exoplanets_with_esi': all_exoplanets_with_esi(),
+            'planets_in_habitable_zone': planets_in_habitable_zone(),
+            'potentially_habitable_exoplanets': potentially_habitable_exoplanets(),
+            'habitability_type': stage('identify_habitability_type', habitability_type_key,
+                                       planets_in_habitable_zone),
+            'surviving_extremophiles': stage('identifying_surviving_extremophiles', extremophiles_key,
+                                             extremophiles_csv, potentially_habitable_exoplanets)}
@@ -0,0 +1,199 @@
+"""
+Sorted indexes over a scored exoplanets catalog for repeated range and top-k queries.
+
+Description:
+    get_habitable_zone_planets and get_potentially_habitable_exoplanets scan the whole catalog on every call. A
+    PlanetIndex sorts the catalog once on the ESI, the distance, the estimated radius and mass and on the position of
+    the planet inside the optimistic and conservative habitable zones of its star, where 0 is the inner and 1 the
+    outer edge of the zone. A query then finds the rows matching each condition with a binary search, starts from
+    the most selective condition and only checks the others on those rows.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+# columns indexed as they are, and the habitable zone positions derived from the star columns
+INDEXED_COLUMNS = ['P_calculated_ESI', 'P_DISTANCE', 'P_RADIUS_EST', 'P_MASS_EST']
+HABITABLE_ZONES = {'optimistic': ('S_HZ_OPT_MIN', 'S_HZ_OPT_MAX', 'P_HZ_OPT_POSITION'),
+                   'conservative': ('S_HZ_CON_MIN', 'S_HZ_CON_MAX', 'P_HZ_CON_POSITION')}
+
+
+def habitable_zone_position(distance, zone_minimum, zone_maximum) -> np.ndarray:
+    """
+    Locate planets relative to the habitable zone of their star.
+    :param distance: distance of each planet from its star.
+    :param zone_minimum: inner edge of the habitable zone of each planet's star.
+    :param zone_maximum: outer edge of the habitable zone of each planet's star.
+    :return: (distance - minimum) / (maximum - minimum), missing where the zone is empty.
+    >>> habitable_zone_position(np.array([1.0, 0.5, 3.0]), np.array([0.8, 0.8, 0.0]), np.array([1.8, 1.8, 0.0]))
+    array([ 0.2, -0.3,  nan])
+    """
+    distance = np.asarray(distance, dtype=float)
+    zone_minimum = np.asarray(zone_minimum, dtype=float)
+    zone_maximum = np.asarray(zone_maximum, dtype=float)
+    zone_width = zone_maximum - zone_minimum
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(zone_width > 0, (distance - zone_minimum) / zone_width, np.nan)
+
+
+class PlanetIndex:
+    """
+    Sorted indexes over a scored exoplanets catalog.
+    >>> planets = pd.DataFrame({'P_NAME': ['a', 'b', 'c', 'd'], 'P_calculated_ESI': [0.2, 0.9, 0.7, 0.65],
+    ...                         'P_DISTANCE': [1.0, 1.0, 3.0, 0.9], 'P_RADIUS_EST': [1.0, 1.1, 2.0, 1.3],
+    ...                         'P_MASS_EST': [1.0, 1.2, 6.0, 2.0],
+    ...                         'S_HZ_OPT_MIN': [0.5, 0.5, 0.5, 0.8], 'S_HZ_OPT_MAX': [2.0, 2.0, 2.0, 1.5],
+    ...                         'S_HZ_CON_MIN': [0.7, 0.7, 0.7, 0.9], 'S_HZ_CON_MAX': [1.5, 1.5, 1.5, 1.2]})
+    >>> index = PlanetIndex(planets)
+    >>> index.query(P_calculated_ESI=(0.6, None), zone='optimistic')['P_NAME'].tolist()
+    ['b', 'd']
+    >>> index.count(P_calculated_ESI=(0.6, None))
+    3
+    >>> index.top_k(2, zone='conservative')['P_NAME'].tolist()
+    ['b', 'a']
+    """
+
+    def __init__(self, exoplanets: pd.DataFrame):
+        self.exoplanets = exoplanets
+        self._values = {column: exoplanets[column].to_numpy(dtype=float) for column in INDEXED_COLUMNS}
+        for zone_minimum, zone_maximum, position_column in HABITABLE_ZONES.values():
+            self._values[position_column] = habitable_zone_position(self._values['P_DISTANCE'],
+                                                                    exoplanets[zone_minimum].to_numpy(dtype=float),
+                                                                    exoplanets[zone_maximum].to_numpy(dtype=float))
+        self._zone_edges = {zone: (exoplanets[zone_minimum].to_numpy(dtype=float),
+                                   exoplanets[zone_maximum].to_numpy(dtype=float))
+                            for zone, (zone_minimum, zone_maximum, _) in HABITABLE_ZONES.items()}
+        self._order = {}
+        self._sorted_values = {}
+        self._valid_count = {}
+        for column, values in self._values.items():
+            # missing values sort last and are left out of every range
+            order = np.argsort(values, kind='stable')
+            self._order[column] = order
+            self._sorted_values[column] = values[order]
+            self._valid_count[column] = int(np.count_nonzero(~np.isnan(values)))
+
+    @property
+    def indexed_columns(self) -> list:
+        return list(self._values)
+
+    def _bounds(self, column: str, minimum=None, maximum=None) -> (int, int):
+        sorted_values = self._sorted_values[column]
+        start = 0 if minimum is None else int(np.searchsorted(sorted_values, minimum, side='left'))
+        stop = self._valid_count[column] if maximum is None else int(np.searchsorted(
+            sorted_values[:self._valid_count[column]], maximum, side='right'))
+        return start, max(start, stop)
+
+    def _conditions(self, ranges: dict, zone) -> list:
+        conditions = []
+        for column, (minimum, maximum) in ranges.items():
+            if column not in self._values:
+                raise KeyError("{} is not indexed, use one of {}".format(column, self.indexed_columns))
+            conditions.append((column, minimum, maximum))
+        if zone is not None:
+            if zone not in HABITABLE_ZONES:
+                raise ValueError("zone must be one of {}, got {!r}".format(list(HABITABLE_ZONES), zone))
+            # the zone position is only a superset of the planets inside the zone, they are checked exactly after
+            conditions.append((HABITABLE_ZONES[zone][2], 0.0, 1.0))
+        return conditions
+
+    def _in_zone(self, positions: np.ndarray, zone: str) -> np.ndarray:
+        zone_minimum, zone_maximum = self._zone_edges[zone]
+        distance = self._values['P_DISTANCE'][positions]
+        # the same strict comparison as get_habitable_zone_planets
+        return (distance > zone_minimum[positions]) & (distance < zone_maximum[positions])
+
+    def positions(self, zone: str = None, **ranges) -> np.ndarray:
+        """
+        Find the rows matching every condition.
+        :param zone: 'optimistic' or 'conservative' to keep only planets inside that habitable zone.
+        :param ranges: indexed column name mapped to an inclusive (minimum, maximum) pair, None leaves a side open.
+        :return: row positions of the matching planets in catalog order.
+        """
+        conditions = self._conditions(ranges, zone)
+        if not conditions:
+            return np.arange(len(self.exoplanets))
+        bounds = [self._bounds(column, minimum, maximum) for column, minimum, maximum in conditions]
+        # start from the condition with the fewest rows and check the others on those rows only
+        most_selective = int(np.argmin([stop - start for start, stop in bounds]))
+        start, stop = bounds[most_selective]
+        candidates = self._order[conditions[most_selective][0]][start:stop]
+        remaining_conditions = conditions[:most_selective] + conditions[most_selective + 1:]
+        return np.sort(self._filter(candidates, remaining_conditions, zone))
+
+    def _filter(self, candidates: np.ndarray, conditions: list, zone) -> np.ndarray:
+        for column, minimum, maximum in conditions:
+            values = self._values[column][candidates]
+            keep = ~np.isnan(values)
+            if minimum is not None:
+                keep &= values >= minimum
+            if maximum is not None:
+                keep &= values <= maximum
+            candidates = candidates[keep]
+        if zone is not None:
+            candidates = candidates[self._in_zone(candidates, zone)]
+        return candidates
+
+    def query(self, zone: str = None, **ranges) -> pd.DataFrame:
+        """
+        Select the planets matching every condition.
+        :param zone: 'optimistic' or 'conservative' to keep only planets inside that habitable zone.
+        :param ranges: indexed column name mapped to an inclusive (minimum, maximum) pair, None leaves a side open.
+        :return: the matching rows of the catalog, in catalog order.
+        """
+        return self.exoplanets.iloc[self.positions(zone, **ranges)]
+
+    def count(self, **ranges) -> int:
+        """
+        Count the planets inside a single inclusive range without touching the rows.
+        :param ranges: one indexed column name mapped to a (minimum, maximum) pair.
+        :return: number of planets in the range.
+        """
+        if len(ranges) != 1:
+            return len(self.positions(**ranges))
+        (column, (minimum, maximum)), = ranges.items()
+        start, stop = self._bounds(column, minimum, maximum)
+        return stop - start
+
+    def top_k(self, k: int, column: str = 'P_calculated_ESI', zone: str = None, **ranges) -> pd.DataFrame:
+        """
+        Select the k planets with the largest value of an indexed column among those matching the conditions.
+        :param k: number of planets wanted.
+        :param column: indexed column to rank by.
+        :param zone: 'optimistic' or 'conservative' to keep only planets inside that habitable zone.
+        :param ranges: indexed column name mapped to an inclusive (minimum, maximum) pair, None leaves a side open.
+        :return: at most k rows of the catalog, largest value first.
+        """
+        order = self._order[column][:self._valid_count[column]][::-1]
+        if not ranges and zone is None:
+            return self.exoplanets.iloc[order[:k]]
+        # walk down the ranking in growing batches until enough planets pass the conditions
+        conditions = self._conditions(ranges, zone)
+        selected = []
+        found = 0
+        start = 0
+        batch = max(k, 1)
+        while found < k and start < len(order):
+            block = self._filter(order[start:start + batch], conditions, zone)
+            selected.append(block)
+            found += len(block)
+            start += batch
+            batch *= 2
+        return self.exoplanets.iloc[np.concatenate(selected)[:k] if selected else []]
+
+    def habitable_zone_planets(self, zone: str = 'optimistic') -> pd.DataFrame:
+        """
+        Same planets as get_habitable_zone_planets, from the index.
+        :param zone: 'optimistic' as get_habitable_zone_planets, or 'conservative'.
+        :return: the planets inside the habitable zone, in catalog order.
+        """
+        return self.query(zone=zone)
+
+    def potentially_habitable_exoplanets(self, threshold: float = 0.6) -> pd.DataFrame:
+        """
+        Same planets as get_potentially_habitable_exoplanets, from the index.
+        :param threshold: smallest ESI kept.
+        :return: the planets with an ESI of at least the threshold, in catalog order.
+        """
+        return self.query(P_calculated_ESI=(threshold, None))
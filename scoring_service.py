@@ -0,0 +1,444 @@
+"""
+Local asyncio service scoring exoplanets with the functions of data_analysis.py.
+
+Description:
+    Clients connect over TCP and send one JSON object per line, a planet with the columns create_exoplanets_catalog
+    keeps, and get one JSON line back per planet with its ESI, habitable zone membership, habitability class and
+    the strains surviving on it. An optional "id" field is echoed back, so a client can keep many planets in flight
+    on one connection. The line {"command": "stats"} returns the number of requests and batches and the p50 and p99
+    latency.
+
+    Requests arriving together are coalesced: a batcher task waits for the first pending planet, keeps collecting
+    for at most max_batch_delay seconds or until max_batch_size planets are waiting, and scores the whole batch with
+    one call of each data_analysis function. The extremophile ranges are read once when the service starts. Each
+    connection keeps at most max_in_flight planets in flight and stops reading until one completes, and a planet
+    arriving while max_pending planets are already waiting is answered with an "overloaded" error straight away.
+    A planet is checked and converted to the catalog dtypes before it joins a batch, missing fields are 0 as in
+    create_exoplanets_catalog and a field that is not a number is answered with an error for that planet alone. A
+    batch that fails anyway is scored again one planet at a time, so only the planet at fault gets the error. A line
+    that is not a JSON object is answered with an "invalid request" error, and the planets still waiting when the
+    service stops fail with ServiceStopped.
+
+Direction to run the service:
+    1. python scoring_service.py --port 8765
+    2. python scoring_service.py --port 8765 --load-test 20000
+"""
+
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+DEFAULT_MAX_BATCH_SIZE = 512
+DEFAULT_MAX_BATCH_DELAY = 0.002
+DEFAULT_MAX_PENDING = 10000
+DEFAULT_MAX_IN_FLIGHT = 256
+# number of most recent latencies the percentiles are computed over
+LATENCY_WINDOW = 100000
+
+
+class ServiceOverloaded(Exception):
+    pass
+
+
+class ServiceStopped(Exception):
+    pass
+
+
+def score_planets(planets: pd.DataFrame, extremophiles: pd.DataFrame) -> list:
+    r"""
+    Score a batch of planets with the functions of data_analysis.py.
+    :param planets: dataframe with the columns create_exoplanets_catalog keeps, missing values as 0.
+    :param extremophiles: dataframe returned by read_extremophiles_ranges.
+    :return: list with one result dictionary per planet, in input order.
+    >>> planets = pd.DataFrame({'P_NAME': ['Earth'], 'P_MASS': [1.0], 'P_RADIUS': [1.0], 'P_DENSITY': [1.0],
+    ...                         'P_ESCAPE': [1.0], 'P_TEMP_EQUIL': [288.0], 'P_TEMP_EQUIL_MIN': [250.0],
+    ...                         'P_TEMP_EQUIL_MAX': [300.0], 'P_FLUX': [1.0], 'P_DISTANCE': [1.0],
+    ...                         'S_HZ_OPT_MIN': [0.8], 'S_HZ_OPT_MAX': [1.6], 'P_RADIUS_EST': [1.0],
+    ...                         'P_MASS_EST': [1.0]})
+    >>> result = score_planets(planets, da.read_extremophiles_ranges(".\\data\\Extremophiles Range.csv"))[0]
+    >>> result['P_calculated_ESI'], result['P_IN_HABITABLE_ZONE'], result['P_HABITABILITY_CLASS']
+    (1.0, True, 'conservative')
+    >>> result['surviving_strains']['temperature']
+    ['Colwell/a piezophila ATCC BAA-637', 'Colwell/a sp.MT-41', 'Pedobacter arcticus A12']
+    """
+    planets = da.calculate_ESI(planets.reset_index(drop=True))
+    earth_similarity_index = planets['P_calculated_ESI'].to_numpy()
+    potentially_habitable = np.zeros(len(planets), dtype=bool)
+    potentially_habitable[da.get_potentially_habitable_exoplanets(planets).index] = True
+    in_habitable_zone = np.zeros(len(planets), dtype=bool)
+    in_habitable_zone[da.get_habitable_zone_planets(planets).index] = True
+    habitability_class = da.classify_habitability(planets).astype(str).to_numpy()
+    strain_names, surviving_pairs = da.match_surviving_extremophiles(extremophiles, planets)
+    surviving_strains = [{criterion: [] for criterion in da.SURVIVAL_CRITERIA} for _ in range(len(planets))]
+    for criterion, (planet_positions, strain_positions) in zip(da.SURVIVAL_CRITERIA, surviving_pairs):
+        for planet_position, strain_position in zip(planet_positions.tolist(), strain_positions.tolist()):
+            surviving_strains[planet_position][criterion].append(strain_names[strain_position])
+    return [{'P_NAME': planets['P_NAME'].iat[position],
+             'P_calculated_ESI': None if np.isnan(earth_similarity_index[position])
+             else float(earth_similarity_index[position]),
+             'P_POTENTIALLY_HABITABLE': bool(potentially_habitable[position]),
+             'P_IN_HABITABLE_ZONE': bool(in_habitable_zone[position]),
+             'P_HABITABILITY_CLASS': habitability_class[position],
+             'surviving_strains': surviving_strains[position]}
+            for position in range(len(planets))]
+
+
+def planet_record(planet: dict) -> dict:
+    """
+    Check a posted planet and convert it the way create_exoplanets_catalog reads a catalog row.
+    :param planet: dictionary with some of the columns create_exoplanets_catalog keeps, other keys are ignored.
+    :return: dictionary with every one of those columns, missing or null values as 0.
+    >>> planet_record({'P_NAME': 'K2-18 b', 'P_DENSITY': '1.5'})['P_DENSITY'], planet_record({})['P_FLUX']
+    (1.5, 0.0)
+    >>> planet_record({'P_DENSITY': 'heavy'})
+    Traceback (most recent call last):
+    ...
+    ValueError: P_DENSITY must be a number, got 'heavy'
+    """
+    if not isinstance(planet, dict):
+        raise ValueError("a planet must be a JSON object, got {!r}".format(planet))
+    record = {}
+    for column in da.REQUIRED_COLUMNS:
+        value = planet.get(column)
+        if column not in da.CATALOG_NUMERIC_DTYPES:
+            record[column] = 0 if value is None else str(value)
+            continue
+        try:
+            number = 0.0 if value is None else float(value)
+        except (TypeError, ValueError):
+            raise ValueError("{} must be a number, got {!r}".format(column, value)) from None
+        record[column] = 0.0 if math.isnan(number) else number
+    return record
+
+
+def _planets_dataframe(records: list) -> pd.DataFrame:
+    return pd.DataFrame.from_records(records, columns=da.REQUIRED_COLUMNS).astype(da.CATALOG_NUMERIC_DTYPES)
+
+
+class ScoringService:
+    r"""
+    Coalesces concurrent score requests into batches scored by score_planets.
+    >>> async def score_three(service):
+    ...     async with service:
+    ...         planets = [{'P_NAME': name, 'P_DENSITY': 1.0, 'P_ESCAPE': 1.0, 'P_TEMP_EQUIL': 288.0}
+    ...                    for name in ('a', 'b', 'c')]
+    ...         return await asyncio.gather(*(service.score(planet) for planet in planets))
+    >>> service = ScoringService(".\\data\\Extremophiles Range.csv")
+    >>> [result['P_calculated_ESI'] for result in asyncio.run(score_three(service))]
+    [1.0, 1.0, 1.0]
+    >>> service.stats()['batches']
+    1
+    >>> async def score_all(service, planets):
+    ...     async with service:
+    ...         return await asyncio.gather(*(service.score(planet) for planet in planets), return_exceptions=True)
+    >>> planets = [{'P_NAME': 'a', 'P_DENSITY': 1.0}, {'P_NAME': 'b', 'P_DENSITY': 'heavy'}, {'P_NAME': 'c'}]
+    >>> [type(result).__name__ for result in asyncio.run(score_all(service, planets))]
+    ['dict', 'ValueError', 'dict']
+    >>> # a planet posted without P_FLUX scores as the catalog row with P_FLUX 0 does
+    >>> catalog = da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")
+    >>> planet = {column: value.item() if hasattr(value, 'item') else value
+    ...           for column, value in catalog.loc[1029].drop('P_FLUX').items()}
+    >>> result = asyncio.run(score_all(service, [planet]))[0]
+    >>> surviving_extremophiles = da.identifying_surviving_extremophiles(".\\data\\Extremophiles Range.csv",
+    ...                                                                  catalog.loc[[1029]].assign(P_FLUX=0.0))
+    >>> [result['surviving_strains'][criterion] == table['Strain'].tolist()
+    ...  for criterion, table in zip(da.SURVIVAL_CRITERIA, surviving_extremophiles)]
+    [True, True, True]
+    >>> len(result['surviving_strains']['radiation'])
+    23
+    """
+
+    def __init__(self, extremophiles_csv, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_batch_delay: float = DEFAULT_MAX_BATCH_DELAY, max_pending: int = DEFAULT_MAX_PENDING):
+        self.extremophiles = da.read_extremophiles_ranges(extremophiles_csv)
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.max_pending = max_pending
+        self._pending = collections.deque()
+        self._wake_up = None
+        self._batch_full = None
+        self._batcher = None
+        # the batch being scored, failed with the pending planets when the service stops
+        self._scoring = []
+        # batches are scored one at a time off the event loop, so reading and writing sockets never waits on them
+        self._executor = None
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._requests = 0
+        self._batches = 0
+        self._rejected = 0
+
+    async def start(self):
+        self._wake_up = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batcher = asyncio.create_task(self._run_batches())
+
+    async def stop(self):
+        r"""
+        Stop batching and fail the planets that are not scored yet with ServiceStopped.
+        >>> async def stop_while_waiting(service):
+        ...     await service.start()
+        ...     waiting = asyncio.ensure_future(service.score({'P_NAME': 'a'}))
+        ...     await asyncio.sleep(0)
+        ...     await service.stop()
+        ...     return await asyncio.gather(waiting, return_exceptions=True)
+        >>> asyncio.run(stop_while_waiting(ScoringService(".\\data\\Extremophiles Range.csv", max_batch_delay=60)))
+        [ServiceStopped('the scoring service stopped')]
+        """
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        # fail the planets still waiting, or their callers would await score forever
+        for _, future, _ in self._scoring + list(self._pending):
+            if not future.done():
+                future.set_exception(ServiceStopped("the scoring service stopped"))
+        self._scoring = []
+        self._pending.clear()
+        self._executor.shutdown()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.stop()
+
+    async def score(self, planet: dict) -> dict:
+        """
+        Score one planet in the next batch.
+        :param planet: dictionary with the columns create_exoplanets_catalog keeps, missing ones are 0.
+        :return: result dictionary of score_planets.
+        :raise ValueError: when the planet is not valid, before it joins a batch.
+        :raise ServiceStopped: when the service stops before the planet is scored.
+        """
+        record = planet_record(planet)
+        if self._batcher is None or self._batcher.done():
+            raise ServiceStopped("the scoring service is not running")
+        if len(self._pending) >= self.max_pending:
+            self._rejected += 1
+            raise ServiceOverloaded("{} planets are already waiting".format(len(self._pending)))
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, future, time.perf_counter()))
+        self._wake_up.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake_up.wait()
+            # give concurrent requests a moment to join the batch unless it is already full
+            if len(self._pending) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_batch_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [self._pending.popleft() for _ in range(min(self.max_batch_size, len(self._pending)))]
+            if len(self._pending) < self.max_batch_size:
+                self._batch_full.clear()
+            if not self._pending:
+                self._wake_up.clear()
+            self._scoring = batch
+            results = await self._score_batch(loop, batch)
+            self._scoring = []
+            finished = time.perf_counter()
+            self._batches += 1
+            for (_, future, received), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                    continue
+                self._requests += 1
+                self._latencies.append(finished - received)
+                future.set_result(result)
+
+    async def _score_batch(self, loop, batch: list) -> list:
+        try:
+            return await loop.run_in_executor(self._executor, score_planets,
+                                              _planets_dataframe([record for record, _, _ in batch]),
+                                              self.extremophiles)
+        except Exception as error:
+            if len(batch) == 1:
+                return [error]
+        # score the planets one at a time, so only the one at fault gets the error
+        results = []
+        for request in batch:
+            results.extend(await self._score_batch(loop, [request]))
+        return results
+
+    def stats(self) -> dict:
+        """
+        Report the requests served so far and the latency of the most recent ones.
+        :return: dictionary with the requests, batches, rejected requests, mean batch size and p50 and p99 latency
+        in milliseconds.
+        """
+        latencies = np.array(self._latencies) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (None, None)
+        return {'requests': self._requests, 'batches': self._batches, 'rejected': self._rejected,
+                'mean_batch_size': self._requests / self._batches if self._batches else None,
+                'p50_ms': None if p50 is None else float(p50), 'p99_ms': None if p99 is None else float(p99)}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        r"""
+        Serve the JSON lines of one client connection.
+        :param reader: stream of the client requests.
+        :param writer: stream the responses are written to.
+        :param max_in_flight: largest number of planets of this connection being scored at a time.
+        >>> async def send_lines(service, lines):
+        ...     async with service:
+        ...         server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+        ...         async with server:
+        ...             reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        ...             writer.write(b''.join(line + b'\n' for line in lines))
+        ...             responses = [json.loads(await reader.readline()) for _ in lines]
+        ...             writer.close()
+        ...             return responses
+        >>> service = ScoringService(".\\data\\Extremophiles Range.csv")
+        >>> for response in asyncio.run(send_lines(service, [b'5', b'{"command": "stats", "id": 7}'])):
+        ...     print(response.get('error'), response.get('message'), response.get('id'))
+        invalid request a request must be a JSON object, got 5 None
+        None None 7
+        """
+        in_flight = asyncio.Semaphore(max_in_flight)
+        tasks = set()
+
+        async def respond(request: dict):
+            try:
+                if request.get('command') == 'stats':
+                    response = self.stats()
+                else:
+                    response = await self.score(request)
+            except ServiceOverloaded as error:
+                response = {'error': 'overloaded', 'message': str(error)}
+            except Exception as error:
+                response = {'error': type(error).__name__, 'message': str(error)}
+            finally:
+                in_flight.release()
+            if 'id' in request:
+                response = dict(response, id=request['id'])
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        try:
+            while True:
+                # stop reading, and so let TCP push back on the client, while too many planets are in flight
+                await in_flight.acquire()
+                line = await reader.readline()
+                if not line:
+                    in_flight.release()
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    in_flight.release()
+                    writer.write(json.dumps({'error': 'invalid json', 'message': str(error)}).encode('utf-8') + b'\n')
+                    continue
+                if not isinstance(request, dict):
+                    in_flight.release()
+                    writer.write(json.dumps({'error': 'invalid request',
+                                             'message': "a request must be a JSON object, got {}".format(
+                                                 line.decode('utf-8', 'replace').strip())}).encode('utf-8') + b'\n')
+                    continue
+                task = asyncio.create_task(respond(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+
+async def serve(extremophiles_csv, host: str = '127.0.0.1', port: int = 8765, **service_options):
+    """
+    Run the scoring service until it is cancelled.
+    :param extremophiles_csv: csv file of the extremophiles and the ranges they survive.
+    :param host: address to listen on.
+    :param port: port to listen on.
+    :param service_options: max_batch_size, max_batch_delay and max_pending of the ScoringService.
+    """
+    async with ScoringService(extremophiles_csv, **service_options) as service:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def load_test(planets: list, host: str = '127.0.0.1', port: int = 8765, connections: int = 8) -> dict:
+    """
+    Send planets to a running service over several connections as fast as it accepts them.
+    :param planets: list of planet dictionaries, each one is one request.
+    :param host: address of the service.
+    :param port: port of the service.
+    :param connections: number of client connections sharing the planets.
+    :return: dictionary with the requests, seconds, requests per second and the client side p50 and p99 latency in
+    milliseconds, next to the stats of the service.
+    """
+    latencies = []
+
+    async def client(share: list):
+        reader, writer = await asyncio.open_connection(host, port)
+        sent_at = {}
+
+        async def send():
+            for request_id, planet in share:
+                sent_at[request_id] = time.perf_counter()
+                writer.write(json.dumps(dict(planet, id=request_id)).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        sender = asyncio.create_task(send())
+        for _ in share:
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent_at.pop(response['id']))
+        await sender
+        writer.write(b'{"command": "stats"}\n')
+        service_stats = json.loads(await reader.readline())
+        writer.close()
+        return service_stats
+
+    numbered = list(enumerate(planets))
+    start = time.perf_counter()
+    service_stats = await asyncio.gather(*(client(numbered[share::connections]) for share in range(connections)))
+    seconds = time.perf_counter() - start
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return {'requests': len(planets), 'seconds': seconds, 'requests_per_second': len(planets) / seconds,
+            'p50_ms': float(p50), 'p99_ms': float(p99), 'service': service_stats[-1]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--extremophiles', default=os.path.join('data', 'Extremophiles Range.csv'))
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--max-batch-delay', type=float, default=DEFAULT_MAX_BATCH_DELAY)
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING)
+    parser.add_argument('--load-test', type=int, metavar='REQUESTS',
+                        help='send this many planets of the catalog to a running service instead of serving')
+    parser.add_argument('--exoplanets', default=os.path.join('data', 'phl_exoplanet_catalog.csv'))
+    parser.add_argument('--connections', type=int, default=8)
+    arguments = parser.parse_args()
+
+    if arguments.load_test:
+        catalog = da.create_exoplanets_catalog(arguments.exoplanets)
+        catalog = catalog.astype(object).where(catalog.notna(), None)
+        records = catalog.to_dict('records')
+        requests = [records[position % len(records)] for position in range(arguments.load_test)]
+        print(json.dumps(asyncio.run(load_test(requests, arguments.host, arguments.port, arguments.connections)),
+                         indent=2))
+    else:
+        asyncio.run(serve(arguments.extremophiles, arguments.host, arguments.port,
+                          max_batch_size=arguments.max_batch_size, max_batch_delay=arguments.max_batch_delay,
+                          max_pending=arguments.max_pending))
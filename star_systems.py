@@ -0,0 +1,134 @@
+"""
+Star systems: the star attributes held once per star and the planets of each system analysed together.
+
+Description:
+    The catalog repeats S_RADIUS_EST and the habitable zone bounds on the row of every planet of a star, seven times
+    for TRAPPIST-1. normalize_star_systems moves them to a table with one row per S_NAME and leaves a categorical
+    S_NAME on the planets whose codes are the positions of their stars in that table. summarize_star_systems then
+    gathers the bounds of each planet from its star, compares every planet with them at once and reduces the results
+    per system with bincount and reduceat over the planets sorted by star: the planets in the optimistic and
+    conservative zones, the planet with the best ESI and the strains surviving on at least one planet of the system,
+    matched a block of strains at a time.
+"""
+
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+from compact_catalog import survival_blocks
+
+# columns describing the star, identical on the rows of all the planets of a system
+STAR_ATTRIBUTE_COLUMNS = ['S_RADIUS_EST', 'S_HZ_OPT_MIN', 'S_HZ_OPT_MAX', 'S_HZ_CON_MIN', 'S_HZ_CON_MAX']
+# columns returned by summarize_star_systems
+STAR_SYSTEM_SUMMARY_COLUMNS = ['PLANETS', 'IN_OPTIMISTIC_ZONE', 'IN_CONSERVATIVE_ZONE', 'BEST_ESI',
+                               'BEST_ESI_PLANET'] + \
+                              [criterion.upper() + '_STRAINS' for criterion in da.SURVIVAL_CRITERIA] + \
+                              ['SURVIVING_STRAINS']
+
+
+def normalize_star_systems(exoplanets: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    r"""
+    Split a catalog into its planets and its stars.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog.
+    :return: the planets without STAR_ATTRIBUTE_COLUMNS and with S_NAME as a categorical of the stars, and the stars
+    indexed by S_NAME in order of first appearance.
+    >>> exoplanets = da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")
+    >>> planets, stars = normalize_star_systems(exoplanets)
+    >>> planets.shape, stars.shape
+    ((4048, 15), (3010, 5))
+    >>> stars.loc['TRAPPIST-1', ['S_HZ_OPT_MIN', 'S_HZ_OPT_MAX']].tolist()
+    [0.01943642, 0.052567615]
+    >>> join_star_systems(planets, stars).equals(exoplanets)
+    True
+    """
+    star_codes, star_names = pd.factorize(exoplanets['S_NAME'], sort=False)
+    first_rows = np.unique(star_codes, return_index=True)[1]
+    stars = pd.DataFrame({column: exoplanets[column].to_numpy()[first_rows] for column in STAR_ATTRIBUTE_COLUMNS},
+                         index=pd.Index(np.asarray(star_names, dtype=object), name='S_NAME', dtype='str'))
+    for column in STAR_ATTRIBUTE_COLUMNS:
+        planet_values = exoplanets[column].to_numpy()
+        star_values = stars[column].to_numpy()[star_codes]
+        differing = ~((planet_values == star_values) | (pd.isna(planet_values) & pd.isna(star_values)))
+        if differing.any():
+            raise ValueError("{} differs between the planets of {}".format(
+                column, sorted(set(np.asarray(star_names)[star_codes[differing]]))))
+    planets = exoplanets.drop(columns=STAR_ATTRIBUTE_COLUMNS)
+    planets['S_NAME'] = pd.Categorical.from_codes(star_codes, categories=stars.index)
+    # the column order of the catalog, for join_star_systems
+    planets.attrs['catalog_columns'] = list(exoplanets.columns)
+    return planets, stars
+
+
+def join_star_systems(planets: pd.DataFrame, stars: pd.DataFrame) -> pd.DataFrame:
+    """
+    Put the star attributes back on the rows of their planets, as create_exoplanets_catalog returns them.
+    :param planets: planets returned by normalize_star_systems.
+    :param stars: stars returned by normalize_star_systems.
+    :return: dataframe with the columns of the catalog in catalog order, or with the star attributes last when the
+    order is not known.
+    """
+    star_codes = planets['S_NAME'].cat.codes.to_numpy()
+    exoplanets = planets.assign(S_NAME=planets['S_NAME'].astype('str'))
+    for column in STAR_ATTRIBUTE_COLUMNS:
+        exoplanets[column] = stars[column].to_numpy()[star_codes]
+    return exoplanets[planets.attrs.get('catalog_columns', list(exoplanets.columns))]
+
+
+def summarize_star_systems(exoplanets: pd.DataFrame, extremophiles_csv) -> pd.DataFrame:
+    r"""
+    Summarize each star system of a catalog in one grouped pass over its planets.
+    :param exoplanets: dataframe returned by calculate_ESI.
+    :param extremophiles_csv: csv file of the extremophiles and the ranges they survive.
+    :return: dataframe indexed by S_NAME in order of first appearance with STAR_SYSTEM_SUMMARY_COLUMNS: the number of
+    planets, of planets in the optimistic and in the conservative habitable zone, the best ESI and its planet, the
+    strains surviving each of SURVIVAL_CRITERIA on at least one planet and the strains surviving all of them on at
+    least one planet.
+    >>> exoplanets = da.calculate_ESI(da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv"))
+    >>> systems = summarize_star_systems(exoplanets, ".\\data\\Extremophiles Range.csv")
+    >>> int(systems['IN_OPTIMISTIC_ZONE'].sum()) == len(da.get_habitable_zone_planets(exoplanets))
+    True
+    >>> systems.loc['TRAPPIST-1']
+    PLANETS                            7
+    IN_OPTIMISTIC_ZONE                 4
+    IN_CONSERVATIVE_ZONE               3
+    BEST_ESI                    0.903853
+    BEST_ESI_PLANET         TRAPPIST-1 d
+    TEMPERATURE_STRAINS                4
+    PRESSURE_STRAINS                  23
+    RADIATION_STRAINS                  3
+    SURVIVING_STRAINS                  0
+    Name: TRAPPIST-1, dtype: object
+    """
+    planets, stars = normalize_star_systems(exoplanets)
+    star_codes = planets['S_NAME'].cat.codes.to_numpy()
+    star_count = len(stars)
+    # bounds of the zones gathered from the star of each planet
+    distance = planets['P_DISTANCE'].to_numpy()
+    in_optimistic_zone = (distance > stars['S_HZ_OPT_MIN'].to_numpy()[star_codes]) & \
+                         (distance < stars['S_HZ_OPT_MAX'].to_numpy()[star_codes])
+    in_conservative_zone = (distance > stars['S_HZ_CON_MIN'].to_numpy()[star_codes]) & \
+                           (distance < stars['S_HZ_CON_MAX'].to_numpy()[star_codes])
+    # planets sorted by star and, within a star, by decreasing ESI, so each system starts with its best planet
+    esi = planets['P_calculated_ESI'].to_numpy()
+    by_star = np.lexsort((-esi, star_codes))
+    system_starts = np.searchsorted(star_codes[by_star], np.arange(star_count))
+    best_planets = by_star[system_starts]
+    summary = pd.DataFrame({'PLANETS': np.bincount(star_codes, minlength=star_count),
+                            'IN_OPTIMISTIC_ZONE': np.bincount(star_codes, weights=in_optimistic_zone,
+                                                              minlength=star_count).astype(np.int64),
+                            'IN_CONSERVATIVE_ZONE': np.bincount(star_codes, weights=in_conservative_zone,
+                                                                minlength=star_count).astype(np.int64),
+                            'BEST_ESI': esi[best_planets],
+                            'BEST_ESI_PLANET': planets['P_NAME'].to_numpy()[best_planets]},
+                           index=stars.index)
+    # strains surviving on a planet of the system, a block of strains at a time: the survival of its planets ORed
+    strain_counts = np.zeros((len(da.SURVIVAL_CRITERIA) + 1, star_count), dtype=np.int64)
+    extremophiles = da.read_extremophiles_ranges(extremophiles_csv)
+    for _, survives in survival_blocks(extremophiles, exoplanets):
+        if star_count:
+            survives = np.concatenate([survives, survives.all(axis=0, keepdims=True)])[:, by_star]
+            strain_counts += np.logical_or.reduceat(survives, system_starts, axis=1).sum(axis=2)
+    # one count per criterion, then the strains surviving all of them
+    for column, counts in zip(STAR_SYSTEM_SUMMARY_COLUMNS[-len(strain_counts):], strain_counts):
+        summary[column] = counts
+    return summary
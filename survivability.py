@@ -0,0 +1,216 @@
+"""
+Precomputed planet x extremophile survivability with queries over several criteria answered by bitwise operations.
+
+Description:
+    identifying_surviving_extremophiles returns one table of (planet, strain) pairs per criterion, and finding the
+    strains surviving temperature, pressure and radiation together means grouping and intersecting those tables. A
+    SurvivabilityIndex matches the strains to the planets once and keeps, for each of SURVIVAL_CRITERIA, the
+    survival of every pair as bits packed in 64 bit words twice: one row of strain bits per planet and one row of
+    planet bits per strain. "Surviving all the criteria" is the AND of the rows of the criteria, "surviving at least
+    k of them" the OR of the ANDs of every k of them, and counts are population counts of the resulting words, so a
+    query touches a few words per planet or strain however many strains there are. An index can be saved and loaded
+    as an npz file.
+"""
+
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+from compact_catalog import survival_blocks
+
+# number of bits set in each byte, for numpy versions without bitwise_count
+_BYTE_POPULATION_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1)
+
+
+def pack_rows(survives: np.ndarray) -> np.ndarray:
+    """
+    Pack the last axis of a boolean array into 64 bit words, bit j of word w holding column 64 * w + j.
+    :param survives: boolean array.
+    :return: uint64 array with ceil(columns / 64) words per row.
+    >>> pack_rows(np.array([[True, False, True]]))
+    array([[5]], dtype=uint64)
+    """
+    padding = -survives.shape[-1] % 64
+    padded = np.concatenate([survives, np.zeros(survives.shape[:-1] + (padding,), dtype=bool)], axis=-1)
+    return np.ascontiguousarray(np.packbits(padded, axis=-1, bitorder='little')).view('<u8').astype(np.uint64)
+
+
+def unpack_row(words: np.ndarray, count: int) -> np.ndarray:
+    """
+    Unpack one row of words written by pack_rows.
+    :param words: uint64 array of one row.
+    :param count: number of columns.
+    :return: boolean array of the columns.
+    """
+    return np.unpackbits(np.ascontiguousarray(words).astype('<u8').view(np.uint8), count=count,
+                         bitorder='little').astype(bool)
+
+
+def population_count(words: np.ndarray) -> np.ndarray:
+    """
+    Count the bits set in each row of words.
+    :param words: uint64 array, rows on the first axes and words on the last.
+    :return: number of bits set per row.
+    >>> population_count(np.array([[5, 1], [0, 2 ** 63]], dtype=np.uint64))
+    array([3, 1])
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape[:-1] + (-1,))
+    return _BYTE_POPULATION_COUNTS[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def combine_criteria(words: np.ndarray, at_least: int) -> np.ndarray:
+    """
+    Combine the rows of several criteria into the rows surviving at least some of them.
+    :param words: criteria x rows x words array.
+    :param at_least: number of criteria that have to be survived.
+    :return: rows x words array, the OR over every at_least criteria of their AND.
+    >>> combine_criteria(np.array([[[0b011]], [[0b110]], [[0b100]]], dtype=np.uint64), 2)
+    array([[6]], dtype=uint64)
+    """
+    if not 1 <= at_least <= len(words):
+        raise ValueError("at_least must be between 1 and {}, got {}".format(len(words), at_least))
+    combined = np.zeros(words.shape[1:], dtype=np.uint64)
+    for criteria in itertools.combinations(range(len(words)), at_least):
+        combined |= np.bitwise_and.reduce(words[list(criteria)], axis=0)
+    return combined
+
+
+class SurvivabilityIndex:
+    r"""
+    Packed survival of every strain on every planet, for each of SURVIVAL_CRITERIA.
+    >>> exoplanets = da.get_potentially_habitable_exoplanets(da.calculate_ESI(
+    ...     da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")))
+    >>> index = SurvivabilityIndex.from_extremophiles_csv(".\\data\\Extremophiles Range.csv", exoplanets)
+    >>> index.strains_surviving('HD 80606 b')
+    []
+    >>> index.strains_surviving('HD 80606 b', at_least=2)
+    ['Colwell/a piezophila ATCC BAA-637', 'Colwell/a sp.MT-41']
+    >>> index.planets_surviving('Colwell/a sp.MT-41', criteria=['temperature', 'pressure'])
+    ['HD 80606 b', 'K2-18 b', 'TRAPPIST-1 d']
+    >>> index.top_planets(3, at_least=1)
+             P_NAME  SURVIVABLE_STRAINS
+    0    HD 80606 b                  19
+    1    KOI-3680 b                  15
+    2  Kepler-539 b                  12
+    """
+
+    def __init__(self, planet_names, strain_names, by_planet: np.ndarray, by_strain: np.ndarray):
+        self.planet_names = np.asarray(planet_names, dtype=object)
+        self.strain_names = np.asarray(strain_names, dtype=object)
+        # criteria x planets x strain words, and criteria x strains x planet words
+        self.by_planet = by_planet
+        self.by_strain = by_strain
+        self._planet_positions = pd.Index(self.planet_names)
+        self._strain_positions = pd.Index(self.strain_names)
+
+    @classmethod
+    def from_survives(cls, planet_names, strain_names, survives: np.ndarray) -> 'SurvivabilityIndex':
+        """
+        Pack a boolean criteria x planets x strains array in both orientations.
+        :param planet_names: name of each planet.
+        :param strain_names: name of each strain.
+        :param survives: boolean array of shape (len(SURVIVAL_CRITERIA), planets, strains).
+        :return: SurvivabilityIndex.
+        """
+        return cls(planet_names, strain_names, pack_rows(survives), pack_rows(survives.transpose(0, 2, 1)))
+
+    @classmethod
+    def from_extremophiles_csv(cls, extremophiles_csv, exoplanets: pd.DataFrame) -> 'SurvivabilityIndex':
+        """
+        Match the extremophiles to the planets as identifying_surviving_extremophiles does, a block of 64 strains or
+        more at a time, so no planets x strains array is ever held unpacked.
+        :param extremophiles_csv: csv file of the extremophiles and the ranges they survive, or the dataframe
+        read_extremophiles_ranges returns for it.
+        :param exoplanets: dataframe of the planets to match.
+        :return: SurvivabilityIndex of the planets in catalog order and the strains in file order.
+        """
+        extremophiles = extremophiles_csv if isinstance(extremophiles_csv, pd.DataFrame) else \
+            da.read_extremophiles_ranges(extremophiles_csv)
+        strain_names = extremophiles['Strain'].to_numpy()
+        criteria = len(da.SURVIVAL_CRITERIA)
+        by_planet = np.zeros((criteria, len(exoplanets), -(-len(strain_names) // 64)), dtype=np.uint64)
+        by_strain = np.zeros((criteria, len(strain_names), -(-len(exoplanets) // 64)), dtype=np.uint64)
+        for first_strain, survives in survival_blocks(extremophiles, exoplanets, strains_multiple=64):
+            strains = slice(first_strain, first_strain + survives.shape[2])
+            by_planet[:, :, first_strain // 64:first_strain // 64 + -(-survives.shape[2] // 64)] = pack_rows(survives)
+            by_strain[:, strains] = pack_rows(survives.transpose(0, 2, 1))
+        return cls(exoplanets['P_NAME'].to_numpy(), strain_names, by_planet, by_strain)
+
+    def save(self, file_name):
+        """
+        Store the index as an npz file.
+        :param file_name: file to write.
+        """
+        np.savez(file_name, planet_names=self.planet_names.astype(str), strain_names=self.strain_names.astype(str),
+                 by_planet=self.by_planet, by_strain=self.by_strain)
+
+    @classmethod
+    def load(cls, file_name) -> 'SurvivabilityIndex':
+        """
+        Read an index stored by save.
+        :param file_name: file written by save.
+        :return: SurvivabilityIndex.
+        """
+        with np.load(file_name, allow_pickle=False) as stored:
+            return cls(stored['planet_names'], stored['strain_names'], stored['by_planet'], stored['by_strain'])
+
+    def _criteria(self, criteria) -> list:
+        criteria = da.SURVIVAL_CRITERIA if criteria is None else list(criteria)
+        unknown = [criterion for criterion in criteria if criterion not in da.SURVIVAL_CRITERIA]
+        if unknown or not criteria:
+            raise ValueError("criteria must be taken from {}, got {}".format(da.SURVIVAL_CRITERIA, criteria))
+        return [da.SURVIVAL_CRITERIA.index(criterion) for criterion in criteria]
+
+    def _combined(self, words: np.ndarray, criteria, at_least) -> np.ndarray:
+        criteria = self._criteria(criteria)
+        return combine_criteria(words[criteria], len(criteria) if at_least is None else at_least)
+
+    def strains_surviving(self, planet: str, criteria=None, at_least: int = None) -> list:
+        """
+        Find the strains surviving on a planet.
+        :param planet: P_NAME of the planet.
+        :param criteria: criteria taken into account, all of SURVIVAL_CRITERIA by default.
+        :param at_least: number of those criteria to survive, all of them by default.
+        :return: names of the strains in file order.
+        """
+        position = self._planet_positions.get_loc(planet)
+        words = self._combined(self.by_planet[:, position:position + 1], criteria, at_least)[0]
+        return self.strain_names[unpack_row(words, len(self.strain_names))].tolist()
+
+    def planets_surviving(self, strain: str, criteria=None, at_least: int = None) -> list:
+        """
+        Find the planets a strain survives on.
+        :param strain: name of the strain.
+        :param criteria: criteria taken into account, all of SURVIVAL_CRITERIA by default.
+        :param at_least: number of those criteria to survive, all of them by default.
+        :return: names of the planets in catalog order.
+        """
+        position = self._strain_positions.get_loc(strain)
+        words = self._combined(self.by_strain[:, position:position + 1], criteria, at_least)[0]
+        return self.planet_names[unpack_row(words, len(self.planet_names))].tolist()
+
+    def survivable_strain_counts(self, criteria=None, at_least: int = None) -> np.ndarray:
+        """
+        Count the strains surviving on every planet.
+        :param criteria: criteria taken into account, all of SURVIVAL_CRITERIA by default.
+        :param at_least: number of those criteria to survive, all of them by default.
+        :return: number of strains per planet, in catalog order.
+        """
+        return population_count(self._combined(self.by_planet, criteria, at_least))
+
+    def top_planets(self, k: int = 10, criteria=None, at_least: int = None) -> pd.DataFrame:
+        """
+        Rank the planets on the number of strains surviving on them.
+        :param k: number of planets wanted.
+        :param criteria: criteria taken into account, all of SURVIVAL_CRITERIA by default.
+        :param at_least: number of those criteria to survive, all of them by default.
+        :return: dataframe with P_NAME and SURVIVABLE_STRAINS of at most k planets, most strains first and planets
+        with as many strains in catalog order.
+        """
+        counts = self.survivable_strain_counts(criteria, at_least)
+        order = np.argsort(-counts, kind='stable')[:k]
+        return pd.DataFrame({'P_NAME': self.planet_names[order], 'SURVIVABLE_STRAINS': counts[order]})
@@ -0,0 +1,325 @@
+"""
+Synthetic catalogs shaped like phl_exoplanet_catalog.csv and Extremophiles Range.csv for scale testing.
+
+Description:
+    The distribution of every column is learned from the shipped csv files: the null rate, the empirical
+    distribution of the values, which columns tend to be missing together and, for numeric columns, the rank
+    correlation between them (a gaussian copula), so that pairs such as S_HZ_OPT_MIN and S_HZ_OPT_MAX or P_MASS and
+    P_RADIUS keep moving together. Planets are generated in star systems, with the number of planets per star and
+    the star (S_*) columns shared across the system as in the real catalog.
+
+    Rows are generated in fixed blocks, each drawn from its own random stream derived from the seed and the block
+    number, so a catalog of any size is reproducible and is written to disk block by block without ever being
+    held in memory.
+
+Output formats:
+    1. csv - same header names as the source, readable by create_exoplanets_catalog.
+    2. npy - a folder with one .npy file per column, text columns stored as fixed width bytes.
+"""
+
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import data_analysis as da
+
+EXOPLANETS_CSV = os.path.join('data', 'phl_exoplanet_catalog.csv')
+EXTREMOPHILES_CSV = os.path.join('data', 'Extremophiles Range.csv')
+EXTREMOPHILES_COLUMNS = ['Strain', 'Domain', 'Extremophile_Type', 'Isolation_Ecosystem', 'Mean_Temperature_K',
+                         'Temperature_Min_K', 'Temperature_Max_K', 'Pressure_Min_Bars', 'Pressure_Max_Bars',
+                         'Radiation', 'Salinity', 'pH']
+# columns describing a range, the generated minimum never exceeds the generated maximum
+EXOPLANETS_RANGE_COLUMNS = [('P_TEMP_EQUIL_MIN', 'P_TEMP_EQUIL_MAX'), ('S_HZ_OPT_MIN', 'S_HZ_OPT_MAX'),
+                            ('S_HZ_CON_MIN', 'S_HZ_CON_MAX')]
+EXTREMOPHILES_RANGE_COLUMNS = [('Temperature_Min_K', 'Temperature_Max_K'),
+                               ('Pressure_Min_Bars', 'Pressure_Max_Bars')]
+# number of rows generated from one random stream, a catalog is always generated in blocks of this size
+BLOCK_ROWS = 65536
+# width in bytes of generated names in the npy format
+NAME_WIDTH = 24
+PLANET_LETTERS = 'bcdefghijklmnopqrstuvwxyz'
+
+
+def _standard_normal_cdf(z: np.ndarray) -> np.ndarray:
+    # Abramowitz and Stegun 7.1.26, accurate to 1.5e-7 which is plenty for sampling
+    x = np.abs(z) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    polynomial = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - polynomial * np.exp(-x * x)
+    return 0.5 * (1 + np.sign(z) * erf)
+
+
+def learn_table_profile(file_name, columns, range_columns=(), identifier_column=None, group_column=None) -> dict:
+    r"""
+    Learn the null rate and distribution of the given columns of a csv file.
+    :param file_name: csv file to learn from.
+    :param columns: columns to learn, in the order they are generated.
+    :param range_columns: pairs of (minimum, maximum) columns.
+    :param identifier_column: column with a unique name per row, generated instead of sampled.
+    :param group_column: column naming the group (star) a row belongs to, generated instead of sampled.
+    :return: dictionary describing the table, used by the generate functions.
+    >>> profile = learn_table_profile(".\\data\\Extremophiles Range.csv", EXTREMOPHILES_COLUMNS,
+    ...                               EXTREMOPHILES_RANGE_COLUMNS, identifier_column='Strain')
+    >>> sorted(profile['numeric'])[:3], profile['numeric']['Radiation']['null_rate']
+    (['Mean_Temperature_K', 'Pressure_Max_Bars', 'Pressure_Min_Bars'], 0.8695652173913043)
+    """
+    table = pd.read_csv(file_name, usecols=columns)
+    # keep the column order of the source file so the output reads back the same way
+    columns = list(table.columns)
+    profile = {'columns': columns, 'numeric': {}, 'text': {}, 'range_columns': list(range_columns),
+               'identifier_column': identifier_column, 'group_column': group_column}
+    numeric_columns = [column for column in columns
+                       if column not in (identifier_column, group_column)
+                       and pd.api.types.is_numeric_dtype(table[column])]
+    for column in columns:
+        values = table[column].dropna()
+        null_rate = 1 - len(values) / len(table) if len(table) else 0.0
+        if column in numeric_columns:
+            sorted_values = np.sort(values.to_numpy(dtype=float))
+            profile['numeric'][column] = {
+                'null_rate': null_rate, 'sorted_values': sorted_values,
+                'integer': pd.api.types.is_integer_dtype(table[column]),
+                'dtype': str(table[column].dtype)}
+        elif column not in (identifier_column, group_column):
+            frequencies = values.astype(str).value_counts(normalize=True)
+            profile['text'][column] = {'null_rate': null_rate, 'values': frequencies.index.to_numpy(dtype=object),
+                                       'probabilities': frequencies.to_numpy()}
+    # missing values come in patterns (no mass measured means no density nor escape velocity either), so whole
+    # rows of missing flags are sampled rather than one flag per column
+    sampled_columns = numeric_columns + list(profile['text'])
+    null_patterns = table[sampled_columns].isna().value_counts(normalize=True)
+    profile['null_pattern_columns'] = sampled_columns
+    profile['null_patterns'] = np.array(null_patterns.index.tolist(), dtype=bool).reshape(-1, len(sampled_columns))
+    profile['null_pattern_probabilities'] = null_patterns.to_numpy()
+    # rank correlation of the numeric columns turned into the correlation of a gaussian copula
+    rank_correlation = table[numeric_columns].corr(method='spearman').fillna(0).to_numpy()
+    correlation = 2 * np.sin(np.pi * rank_correlation / 6)
+    np.fill_diagonal(correlation, 1)
+    # pairwise correlations are not always positive definite, clip the eigenvalues before factorising
+    eigenvalues, eigenvectors = np.linalg.eigh(correlation)
+    correlation = eigenvectors @ np.diag(np.clip(eigenvalues, 1e-6, None)) @ eigenvectors.T
+    scale = np.sqrt(np.diag(correlation))
+    profile['numeric_columns'] = numeric_columns
+    profile['copula_factor'] = np.linalg.cholesky(correlation / np.outer(scale, scale))
+    if group_column is not None:
+        group_sizes = table.groupby(group_column, sort=False).size().value_counts(normalize=True).sort_index()
+        profile['group_sizes'] = group_sizes.index.to_numpy()
+        profile['group_size_probabilities'] = group_sizes.to_numpy()
+        profile['group_columns'] = [column for column in columns if column.startswith('S_')
+                                    and column != group_column]
+    return profile
+
+
+def learn_exoplanets_profile(file_name=EXOPLANETS_CSV) -> dict:
+    """
+    Learn the profile of the columns create_exoplanets_catalog reads from phl_exoplanet_catalog.csv.
+    :param file_name: exoplanet catalog csv file.
+    :return: dictionary describing the catalog, used by generate_exoplanet_chunks.
+    """
+    return learn_table_profile(file_name, da.REQUIRED_COLUMNS, EXOPLANETS_RANGE_COLUMNS,
+                               identifier_column='P_NAME', group_column='S_NAME')
+
+
+def learn_extremophiles_profile(file_name=EXTREMOPHILES_CSV) -> dict:
+    """
+    Learn the profile of the columns of Extremophiles Range.csv.
+    :param file_name: extremophiles csv file.
+    :return: dictionary describing the organism table, used by generate_extremophile_chunks.
+    """
+    return learn_table_profile(file_name, EXTREMOPHILES_COLUMNS, EXTREMOPHILES_RANGE_COLUMNS,
+                               identifier_column='Strain')
+
+
+def _sample_numeric(profile: dict, rng: np.random.Generator, rows: int, missing: dict) -> dict:
+    numeric_columns = profile['numeric_columns']
+    uniforms = _standard_normal_cdf(rng.standard_normal((rows, len(numeric_columns))) @ profile['copula_factor'].T)
+    sampled = {}
+    for position, column in enumerate(numeric_columns):
+        details = profile['numeric'][column]
+        sorted_values = details['sorted_values']
+        if len(sorted_values) == 0:
+            values = np.full(rows, np.nan)
+        elif details['integer']:
+            # integer columns such as P_HABITABLE keep their exact categories
+            values = sorted_values[np.minimum((uniforms[:, position] * len(sorted_values)).astype(np.intp),
+                                              len(sorted_values) - 1)]
+        else:
+            values = np.interp(uniforms[:, position] * (len(sorted_values) - 1),
+                               np.arange(len(sorted_values)), sorted_values)
+        if missing[column].any():
+            values = values.astype(float)
+            values[missing[column]] = np.nan
+        sampled[column] = values
+    for minimum_column, maximum_column in profile['range_columns']:
+        minimum, maximum = sampled[minimum_column], sampled[maximum_column]
+        swap = minimum > maximum
+        minimum[swap], maximum[swap] = maximum[swap], minimum[swap].copy()
+    return sampled
+
+
+def _sample_text(profile: dict, rng: np.random.Generator, rows: int, missing: dict) -> dict:
+    sampled = {}
+    for column, details in profile['text'].items():
+        if len(details['values']) == 0:
+            sampled[column] = np.full(rows, np.nan, dtype=object)
+            continue
+        values = details['values'][rng.choice(len(details['values']), size=rows, p=details['probabilities'])]
+        values[missing[column]] = np.nan
+        sampled[column] = values
+    return sampled
+
+
+def _generate_block(profile: dict, seed: int, block: int, rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng([seed, block])
+    null_patterns = profile['null_patterns'][rng.choice(len(profile['null_patterns']), size=rows,
+                                                        p=profile['null_pattern_probabilities'])]
+    missing = dict(zip(profile['null_pattern_columns'], null_patterns.T))
+    columns = _sample_numeric(profile, rng, rows, missing)
+    columns.update(_sample_text(profile, rng, rows, missing))
+    group_column = profile['group_column']
+    identifier_column = profile['identifier_column']
+    if group_column is not None:
+        # draw enough systems to fill the block, the last one is cut short
+        group_sizes = rng.choice(profile['group_sizes'], size=rows, p=profile['group_size_probabilities'])
+        group_sizes = group_sizes[:np.searchsorted(np.cumsum(group_sizes), rows) + 1]
+        group_of_row = np.repeat(np.arange(len(group_sizes)), group_sizes)[:rows]
+        group_starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+        position_in_group = np.arange(rows) - group_starts[group_of_row]
+        # every planet of a system shares the star columns of the first planet
+        for column in profile['group_columns']:
+            columns[column] = columns[column][group_starts[group_of_row]]
+        group_names = pd.Series(group_of_row).map('SYN-{}-{{}}'.format(block).format)
+        columns[group_column] = group_names.to_numpy(dtype=object)
+        letters = np.array(list(PLANET_LETTERS), dtype=object)[position_in_group % len(PLANET_LETTERS)]
+        columns[identifier_column] = (group_names + ' ' + letters).to_numpy(dtype=object)
+    elif identifier_column is not None:
+        columns[identifier_column] = pd.Series(np.arange(rows)).map(
+            'SYN-{}-{{}}'.format(block).format).to_numpy(dtype=object)
+    return pd.DataFrame({column: columns[column] for column in profile['columns']})
+
+
+def generate_table_chunks(profile: dict, rows: int, seed: int = 0):
+    """
+    Generate a synthetic table block by block.
+    :param profile: dictionary returned by learn_table_profile.
+    :param rows: total number of rows to generate.
+    :param seed: seed of the random streams, the same seed always generates the same table.
+    :return: generator of dataframes of at most BLOCK_ROWS rows, indexed by their row number in the table.
+    """
+    for block, start in enumerate(range(0, rows, BLOCK_ROWS)):
+        block_rows = min(BLOCK_ROWS, rows - start)
+        table_block = _generate_block(profile, seed, block, block_rows)
+        table_block.index = pd.RangeIndex(start, start + block_rows)
+        yield table_block
+
+
+def generate_exoplanet_chunks(rows: int, seed: int = 0, profile: dict = None):
+    r"""
+    Generate a synthetic exoplanet catalog with the columns read by create_exoplanets_catalog, block by block.
+    :param rows: total number of planets to generate.
+    :param seed: seed of the random streams.
+    :param profile: profile learned by learn_exoplanets_profile, learned from the shipped catalog by default.
+    :return: generator of dataframes.
+    >>> profile = learn_exoplanets_profile(".\\data\\phl_exoplanet_catalog.csv")
+    >>> catalog = pd.concat(generate_exoplanet_chunks(70000, seed=7, profile=profile))
+    >>> catalog.shape, catalog['P_NAME'].is_unique
+    ((70000, 20), True)
+    >>> catalog.equals(pd.concat(generate_exoplanet_chunks(70000, seed=7, profile=profile)))
+    True
+    """
+    return generate_table_chunks(profile if profile is not None else learn_exoplanets_profile(), rows, seed)
+
+
+def generate_extremophile_chunks(rows: int, seed: int = 0, profile: dict = None):
+    """
+    Generate a synthetic organism table shaped like Extremophiles Range.csv, block by block.
+    :param rows: total number of strains to generate.
+    :param seed: seed of the random streams.
+    :param profile: profile learned by learn_extremophiles_profile, learned from the shipped table by default.
+    :return: generator of dataframes.
+    """
+    return generate_table_chunks(profile if profile is not None else learn_extremophiles_profile(), rows, seed)
+
+
+def write_csv(file_name, chunks) -> int:
+    """
+    Stream generated chunks into a csv file.
+    :param file_name: csv file to write.
+    :param chunks: generator of dataframes, such as generate_exoplanet_chunks.
+    :return: number of rows written.
+    """
+    rows = 0
+    for table_block in chunks:
+        table_block.to_csv(file_name, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+        rows += len(table_block)
+    return rows
+
+
+def write_npy(directory, chunks, rows: int, profile: dict) -> int:
+    """
+    Stream generated chunks into a folder with one memory mapped .npy file per column.
+    :param directory: folder to write the columns to.
+    :param chunks: generator of dataframes, such as generate_exoplanet_chunks.
+    :param rows: total number of rows the chunks hold.
+    :param profile: profile the chunks are generated from.
+    :return: number of rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    text_widths = {column: max([len(str(value).encode('utf-8')) for value in details['values']] + [1])
+                   for column, details in profile['text'].items()}
+    for column in (profile['identifier_column'], profile['group_column']):
+        if column is not None:
+            text_widths[column] = NAME_WIDTH
+    arrays = {}
+    for column in profile['columns']:
+        dtype = 'S{}'.format(text_widths[column]) if column in text_widths else np.float64
+        arrays[column] = np.lib.format.open_memmap(os.path.join(directory, column + '.npy'), mode='w+',
+                                                   dtype=dtype, shape=(rows,))
+    written = 0
+    for table_block in chunks:
+        for column, array in arrays.items():
+            values = table_block[column]
+            if column in text_widths:
+                values = values.fillna('').astype(str).str.encode('utf-8')
+            array[written:written + len(table_block)] = values.to_numpy()
+        written += len(table_block)
+    for array in arrays.values():
+        array.flush()
+    return written
+
+
+def read_npy(directory, columns) -> pd.DataFrame:
+    """
+    Read a table written by write_npy, text columns are decoded and empty text becomes missing.
+    :param directory: folder the columns were written to.
+    :param columns: columns to read.
+    :return: dataframe with the requested columns.
+    """
+    table = {}
+    for column in columns:
+        values = np.load(os.path.join(directory, column + '.npy'), mmap_mode='r')
+        if values.dtype.kind == 'S':
+            values = pd.Series(values).str.decode('utf-8').replace('', np.nan)
+        table[column] = values
+    return pd.DataFrame(table)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write a synthetic exoplanet catalog or extremophiles table.')
+    parser.add_argument('output', help='csv file, or folder for the npy format')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--table', choices=('exoplanets', 'extremophiles'), default='exoplanets')
+    parser.add_argument('--format', choices=('csv', 'npy'), default='csv')
+    arguments = parser.parse_args()
+
+    table_profile = learn_exoplanets_profile() if arguments.table == 'exoplanets' else learn_extremophiles_profile()
+    generated_chunks = generate_table_chunks(table_profile, arguments.rows, arguments.seed)
+    if arguments.format == 'csv':
+        write_csv(arguments.output, generated_chunks)
+    else:
+        write_npy(arguments.output, generated_chunks, arguments.rows, table_profile)
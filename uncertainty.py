@@ -0,0 +1,215 @@
+"""
+Monte Carlo propagation of the uncertainty of the catalog into the ESI, the habitability and extremophile survival.
+
+Description:
+    calculate_ESI and identifying_surviving_extremophiles treat every value of the catalog as exact. Here every
+    planet is drawn many times instead:
+        - the equilibrium temperature is uniform between P_TEMP_EQUIL_MIN and P_TEMP_EQUIL_MAX,
+        - a mass or radius that was not measured (0 in the catalog) is log-normal around P_MASS_EST or P_RADIUS_EST,
+          and the density and escape velocity of the planet are then derived from the drawn mass and radius.
+    Measured values and the distance to the star carry no stated uncertainty and stay fixed, so the habitable zone
+    membership itself is 0 or 1. Each draw is scored like the exact catalog: the ESI as calculate_ESI, the
+    conservative and optimistic classes as identify_habitability_type and survival as
+    identifying_surviving_extremophiles, except that a strain survives the temperature of a draw when the drawn
+    temperature lies within its range. The fraction of draws meeting each condition is reported as its probability.
+
+    Planets are grouped on the quantities they draw and a block of a group is held as planets x samples arrays at a
+    time, so memory stays bounded whatever the number of samples, and a quantity fixed for the group stays one column
+    wide and is computed once per planet. Every planet draws from its own generator seeded with the seed and its row
+    position, so the results do not depend on the block size.
+"""
+
+
+import numpy as np
+import pandas as pd
+import constants as c
+import data_analysis as da
+
+# standard deviation of the natural logarithm of an estimated mass or radius
+ESTIMATE_LOG_SPREAD = 0.25
+# ESI threshold of get_potentially_habitable_exoplanets
+DEFAULT_THRESHOLD = 0.6
+# number of planet x sample draws held in memory at a time
+SAMPLE_BLOCK_VALUES = 2 ** 21
+PROBABILITY_COLUMNS = ['P_ESI_MEAN', 'P_ESI_STD', 'P_POTENTIALLY_HABITABLE_PROBABILITY',
+                       'P_HABITABLE_ZONE_PROBABILITY', 'P_CONSERVATIVE_PROBABILITY', 'P_OPTIMISTIC_PROBABILITY']
+
+
+def _drawn_quantities(exoplanets: pd.DataFrame) -> (np.ndarray, np.ndarray, np.ndarray):
+    # which planets have a temperature range, and which miss a measured mass or radius that has an estimate
+    ranged_temperature = (exoplanets['P_TEMP_EQUIL_MAX'].to_numpy(dtype=float)
+                          > exoplanets['P_TEMP_EQUIL_MIN'].to_numpy(dtype=float))
+    estimated_mass = ~(exoplanets['P_MASS'].to_numpy(dtype=float) > 0) & \
+        (exoplanets['P_MASS_EST'].to_numpy(dtype=float) > 0)
+    estimated_radius = ~(exoplanets['P_RADIUS'].to_numpy(dtype=float) > 0) & \
+        (exoplanets['P_RADIUS_EST'].to_numpy(dtype=float) > 0)
+    return ranged_temperature, estimated_mass, estimated_radius
+
+
+def _draw_block(rows: pd.DataFrame, positions: np.ndarray, samples: int, seed: int, estimate_spread: float,
+                ranged_temperature: bool, estimated_mass: bool, estimated_radius: bool) -> dict:
+    # every planet of the block draws the same quantities, the others stay one column wide and broadcast
+    def column(name):
+        return rows[name].to_numpy(dtype=float)[:, np.newaxis]
+
+    temperature, mass, radius = column('P_TEMP_EQUIL'), column('P_MASS'), column('P_RADIUS')
+    density, escape = column('P_DENSITY'), column('P_ESCAPE')
+    mass_for_class, radius_for_class = column('P_MASS_EST'), column('P_RADIUS_EST')
+    if ranged_temperature:
+        temperature = np.empty((len(rows), samples))
+    if estimated_mass:
+        mass = np.empty((len(rows), samples))
+    if estimated_radius:
+        radius = np.empty((len(rows), samples))
+    for row, position in enumerate(positions):
+        generator = np.random.default_rng([seed, position])
+        if ranged_temperature:
+            temperature[row] = generator.uniform(rows['P_TEMP_EQUIL_MIN'].iat[row], rows['P_TEMP_EQUIL_MAX'].iat[row],
+                                                 samples)
+        if estimated_mass:
+            mass[row] = mass_for_class[row] * np.exp(estimate_spread * generator.standard_normal(samples))
+        if estimated_radius:
+            radius[row] = radius_for_class[row] * np.exp(estimate_spread * generator.standard_normal(samples))
+    if estimated_mass or estimated_radius:
+        # earth units: density is mass / radius^3 and escape velocity sqrt(mass / radius), the estimates are the
+        # measured values when there are any, so identify_habitability_type reads the drawn ones
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = mass / radius ** 3
+            escape = np.sqrt(mass / radius)
+        mass_for_class = mass if estimated_mass else mass_for_class
+        radius_for_class = radius if estimated_radius else radius_for_class
+    return {'temperature': temperature, 'mass': mass, 'radius': radius, 'density': density, 'escape': escape,
+            'mass_for_class': mass_for_class, 'radius_for_class': radius_for_class}
+
+
+def _sample_ESI(draws: dict) -> np.ndarray:
+    # the terms and the power of calculate_ESI, the radius term is not part of the index there either
+    earth_similarity_index = (da.calculate_similarity_term(draws['density'], c.REFERENCE_VALUE_DENSITY,
+                                                           c.WEIGHT_EXPONENT_DENSITY)
+                              * da.calculate_similarity_term(draws['escape'], c.REFERENCE_VALUE_VELOCITY,
+                                                             c.WEIGHT_EXPONENT_VELOCITY)
+                              * da.calculate_similarity_term(draws['temperature'], c.REFERENCE_VALUE_TEMPERATURE,
+                                                             c.WEIGHT_EXPONENT_TEMPERATURE))
+    with np.errstate(invalid='ignore'):
+        return earth_similarity_index ** (1 / c.NUMBER_OF_PARAMETERS_TO_CALCULATE_ESI)
+
+
+def fraction_above(values: np.ndarray, edges: np.ndarray, side: str = 'left') -> np.ndarray:
+    """
+    Find, for every row of draws and every edge, the fraction of the draws above the edge, with one binary search per
+    draw instead of one comparison per draw and edge.
+    :param values: planets x samples array of draws, missing draws are never counted.
+    :param edges: sorted array of edges.
+    :param side: 'left' for the draws strictly above each edge, 'right' to also count the draws equal to it.
+    :return: planets x edges array of fractions.
+    >>> fraction_above(np.array([[1.0, 2.0, 3.0, np.nan]]), np.array([2.0, 5.0]), 'right')
+    array([[0.5, 0. ]])
+    """
+    number_of_rows = values.shape[0]
+    number_of_bins = len(edges) + 2
+    # bin b holds the draws with b edges below them (at or below them for side='right'), missing draws the last
+    bins = np.searchsorted(edges, values, side=side)
+    bins[np.isnan(values)] = number_of_bins - 1
+    row_offsets = (np.arange(number_of_rows) * number_of_bins)[:, np.newaxis]
+    histogram = np.bincount((bins + row_offsets).ravel(), minlength=number_of_rows * number_of_bins)
+    histogram = histogram.reshape(number_of_rows, number_of_bins)[:, 1:-1]
+    return np.cumsum(histogram[:, ::-1], axis=1)[:, ::-1] / values.shape[1]
+
+
+def _read_extremophiles(extremophiles_csv) -> pd.DataFrame:
+    return pd.read_csv(extremophiles_csv, usecols=['Strain', 'Temperature_Min_K', 'Temperature_Max_K',
+                                                   'Pressure_Min_Bars', 'Radiation']).fillna(0)
+
+
+def propagate_uncertainty(exoplanets: pd.DataFrame, extremophiles_csv, samples: int = 10000, seed: int = 0,
+                          estimate_spread: float = ESTIMATE_LOG_SPREAD, threshold: float = DEFAULT_THRESHOLD,
+                          block_size: int = None) -> dict:
+    r"""
+    Draw every planet many times and turn the ESI, habitability and extremophile survival into probabilities.
+    :param exoplanets: dataframe returned by create_exoplanets_catalog.
+    :param extremophiles_csv: csv file of the extremophiles and the ranges they survive.
+    :param samples: number of draws per planet.
+    :param seed: seed of the random draws.
+    :param estimate_spread: standard deviation of the natural logarithm of an estimated mass or radius.
+    :param threshold: smallest ESI of a potentially habitable planet.
+    :param block_size: number of planets drawn at a time, by default enough to fill SAMPLE_BLOCK_VALUES.
+    :return: dictionary with a 'planets' dataframe holding P_NAME and the PROBABILITY_COLUMNS, and 'temperature',
+    'pressure' and 'radiation' dataframes with the survival probability of every strain (columns) on every planet
+    (rows), all indexed like the input.
+    >>> exoplanets = da.create_exoplanets_catalog(".\\data\\phl_exoplanet_catalog.csv")
+    >>> trappist = exoplanets.loc[exoplanets['P_NAME'].str.startswith('TRAPPIST-1')]
+    >>> probabilities = propagate_uncertainty(trappist, ".\\data\\Extremophiles Range.csv", samples=2000)
+    >>> probabilities['planets'][['P_NAME', 'P_ESI_MEAN', 'P_POTENTIALLY_HABITABLE_PROBABILITY']].round(3)
+                P_NAME  P_ESI_MEAN  P_POTENTIALLY_HABITABLE_PROBABILITY
+    3806  TRAPPIST-1 b       0.770                                 1.00
+    3807  TRAPPIST-1 c       0.901                                 1.00
+    3808  TRAPPIST-1 d       0.905                                 1.00
+    3809  TRAPPIST-1 e       0.815                                 1.00
+    3810  TRAPPIST-1 f       0.697                                 1.00
+    3811  TRAPPIST-1 g       0.694                                 1.00
+    3812  TRAPPIST-1 h       0.581                                 0.26
+    """
+    extremophiles = _read_extremophiles(extremophiles_csv)
+    strain_names = extremophiles['Strain'].tolist()
+    temperature_min = extremophiles['Temperature_Min_K'].to_numpy(dtype=float)
+    temperature_max = extremophiles['Temperature_Max_K'].to_numpy(dtype=float)
+    pressure_min = extremophiles['Pressure_Min_Bars'].to_numpy(dtype=float)
+    # the ranges of the strains as positions in one sorted array of edges
+    temperature_edges, edge_positions = np.unique(np.concatenate([temperature_min, temperature_max]),
+                                                  return_inverse=True)
+    temperature_min_edge = edge_positions[:len(strain_names)]
+    temperature_max_edge = edge_positions[len(strain_names):]
+    pressure_edges, pressure_edge = np.unique(pressure_min, return_inverse=True)
+
+    number_of_planets = len(exoplanets)
+    if block_size is None:
+        block_size = max(1, SAMPLE_BLOCK_VALUES // max(samples, 1))
+    planet_probabilities = np.zeros((number_of_planets, len(PROBABILITY_COLUMNS)))
+    temperature_survival = np.zeros((number_of_planets, len(strain_names)))
+    pressure_survival = np.zeros((number_of_planets, len(strain_names)))
+    distance = exoplanets['P_DISTANCE'].to_numpy(dtype=float)
+    # the habitable zone of get_habitable_zone_planets, nothing it reads is drawn
+    in_habitable_zone = ((distance > exoplanets['S_HZ_OPT_MIN'].to_numpy(dtype=float))
+                         & (distance < exoplanets['S_HZ_OPT_MAX'].to_numpy(dtype=float)))
+    # group the planets on the quantities they draw, so a quantity that is fixed for a group is computed once
+    drawn_quantities = np.column_stack(_drawn_quantities(exoplanets))
+    for group in np.unique(drawn_quantities, axis=0):
+        group_positions = np.flatnonzero((drawn_quantities == group).all(axis=1))
+        for start in range(0, len(group_positions), block_size):
+            positions = group_positions[start:start + block_size]
+            draws = _draw_block(exoplanets.iloc[positions], positions, samples, seed, estimate_spread, *group)
+            earth_similarity_index = _sample_ESI(draws)
+            rounded_radius = np.round(draws['radius_for_class'], 2)
+            rounded_mass = np.round(draws['mass_for_class'], 2)
+            conservative = (((0.5 < rounded_radius) & (rounded_radius <= 1.5))
+                            | ((0.1 < rounded_mass) & (rounded_mass <= 5.0)))
+            optimistic = (((1.5 < rounded_radius) & (rounded_radius <= 2.5))
+                          | ((5.1 < rounded_mass) & (rounded_mass <= 10.0)))
+            block_in_habitable_zone = in_habitable_zone[positions]
+            planet_probabilities[positions] = np.column_stack([
+                earth_similarity_index.mean(axis=1), earth_similarity_index.std(axis=1),
+                np.mean(earth_similarity_index >= threshold, axis=1), block_in_habitable_zone,
+                block_in_habitable_zone * conservative.mean(axis=1),
+                block_in_habitable_zone * optimistic.mean(axis=1)])
+
+            # a strain survives a draw whose temperature lies within its range
+            within = (fraction_above(draws['temperature'], temperature_edges, 'right')[:, temperature_min_edge]
+                      - fraction_above(draws['temperature'], temperature_edges, 'left')[:, temperature_max_edge])
+            temperature_survival[positions] = np.where(temperature_min <= temperature_max, within, 0)
+            # and a draw whose surface pressure is at most its minimum pressure
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                pressure = da.calculate_pressure(draws['density'] * c.DENSITY, draws['mass'] * c.MASS,
+                                                 draws['radius'] * (c.DIAMETER / 2))
+            valid = np.mean(~np.isnan(pressure), axis=1)[:, np.newaxis]
+            pressure_survival[positions] = valid - fraction_above(pressure, pressure_edges)[:, pressure_edge]
+
+    # the flux is never drawn, a strain either withstands it or not
+    flux = exoplanets['P_FLUX'].to_numpy(dtype=float)[:, np.newaxis] * c.SOLAR_FLUX
+    radiation_survival = (flux <= extremophiles['Radiation'].to_numpy(dtype=float)).astype(float)
+
+    planets = pd.DataFrame(planet_probabilities, index=exoplanets.index, columns=PROBABILITY_COLUMNS)
+    planets.insert(0, 'P_NAME', exoplanets['P_NAME'])
+    return {'planets': planets,
+            'temperature': pd.DataFrame(temperature_survival, index=exoplanets.index, columns=strain_names),
+            'pressure': pd.DataFrame(pressure_survival, index=exoplanets.index, columns=strain_names),
+            'radiation': pd.DataFrame(radiation_survival, index=exoplanets.index, columns=strain_names)}